@@ -0,0 +1,49 @@
+import os
+import sys
+import json
+
+# Settings shared by the GUI and engine.py. Kept free of heavy imports
+# (pandas, selenium) so the window can open before those are needed.
+
+# App state (rate limit history, etc.) lives in the user's home directory
+CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".whatsapp_blast")
+SEGMENTS_PATH = os.path.join(CONFIG_DIR, "segments.json")
+SETTINGS_PATH = os.path.join(CONFIG_DIR, "settings.json")
+
+# --- Window Settings ---
+
+def load_settings():
+    # Last session's inputs (environment, template, sheet, ...) as saved by
+    # MainWindow.save_settings; missing keys fall back to the widget defaults
+    try:
+        with open(SETTINGS_PATH, "r") as f:
+            settings = json.load(f)
+        return settings if isinstance(settings, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_settings(settings):
+    # Written to a temp file first so a crash never leaves half a file behind
+    try:
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        tmp_path = SETTINGS_PATH + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(settings, f, indent=2)
+        os.replace(tmp_path, SETTINGS_PATH)
+    except OSError as e:
+        print(f"Could not save settings: {e}", file=sys.stderr)
+
+# --- Audience Segments ---
+
+def load_segments():
+    # Saved segments are shared by every sheet: {name: expression}
+    try:
+        with open(SEGMENTS_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_segments(segments):
+    os.makedirs(CONFIG_DIR, exist_ok=True)
+    with open(SEGMENTS_PATH, "w") as f:
+        json.dump(segments, f, indent=2)
@@ -0,0 +1,1500 @@
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import itertools
+import threading
+import urllib.parse
+from statistics import median
+from collections import deque
+
+from selenium import webdriver
+from selenium.webdriver.firefox.service import Service
+from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.common.exceptions import JavascriptException, TimeoutException
+from webdriver_manager.firefox import GeckoDriverManager
+
+from config import CONFIG_DIR
+from profiles import ProfileClone, profile_lock_pid
+from sheets import (ResultWriter, SheetCache, campaign_columns, evaluate_segment,
+                    format_time, list_sheets, open_sheets, phone_text, template_columns)
+
+# Sending engine shared by the GUI (main.py) and the command line:
+#   python engine.py --sheet contacts.xlsx --template message.txt --headless
+
+RATE_STATE_PATH = os.path.join(CONFIG_DIR, "rate_limit.json")
+BROWSER_STATS_PATH = os.path.join(CONFIG_DIR, "browser_stats.json")
+
+def debug(message):
+    # Diagnostics go to stderr so stdout stays clean for --json output
+    print(message, file=sys.stderr)
+
+# --- Browser Tuning ---
+
+# Preferences for the "lean browser" mode: WhatsApp Web is one tab, so one
+# content process is enough, and nothing else the browser does in the
+# background (telemetry, updates, studies, session saving, prefetching,
+# animations) helps an unattended run.
+LEAN_PREFS = {
+    # Processes
+    "fission.autostart": False,
+    "dom.ipc.processCount": 1,
+    "dom.ipc.processCount.webIsolated": 1,
+    "dom.ipc.processPrelaunch.enabled": False,
+    "browser.tabs.unloadOnLowMemory": True,
+    # Animations
+    "toolkit.cosmeticAnimations.enabled": False,
+    "ui.prefersReducedMotion": 1,
+    "general.smoothScroll": False,
+    # Telemetry, studies and updates
+    "datareporting.healthreport.uploadEnabled": False,
+    "datareporting.policy.dataSubmissionEnabled": False,
+    "toolkit.telemetry.enabled": False,
+    "toolkit.telemetry.unified": False,
+    "toolkit.telemetry.archive.enabled": False,
+    "app.normandy.enabled": False,
+    "app.shield.optoutstudies.enabled": False,
+    "app.update.auto": False,
+    "app.update.checkInstallTime": False,
+    "extensions.update.enabled": False,
+    "browser.shell.checkDefaultBrowser": False,
+    # Session history and restore
+    "browser.sessionstore.resume_from_crash": False,
+    "browser.sessionstore.interval": 600000,
+    "browser.sessionstore.max_tabs_undo": 0,
+    "browser.sessionhistory.max_entries": 5,
+    "browser.sessionhistory.max_total_viewers": 0,
+    "browser.startup.page": 0,
+    "browser.newtabpage.enabled": False,
+    "extensions.pocket.enabled": False,
+    # Caches (KB) and speculative network work
+    "browser.cache.memory.capacity": 32768,
+    "browser.cache.disk.capacity": 65536,
+    "image.mem.surfacecache.max_size_kb": 65536,
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "network.http.speculative-parallel-limit": 0,
+}
+
+def process_tree_rss(pid):
+    # Resident memory (bytes) of pid and all its descendants, read from
+    # /proc. Firefox spreads a session over several processes. None when
+    # /proc is unavailable (not Linux).
+    if not pid or not os.path.isdir("/proc"):
+        return None
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, ValueError, IndexError):
+            pass
+    return total
+
+def load_browser_stats():
+    # Last run's figures per browser mode: {"lean"|"default": {...}}
+    try:
+        with open(BROWSER_STATS_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_browser_stats(stats):
+    try:
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        with open(BROWSER_STATS_PATH, "w") as f:
+            json.dump(stats, f, indent=2)
+    except OSError as e:
+        debug(f"Could not save browser stats: {e}")
+
+MB = 1024 * 1024
+
+class RecyclePolicy:
+    # When to restart Firefox at a row boundary. WhatsApp Web grows with every
+    # chat opened, so a long run slows down and eventually crashes the
+    # driver. Looks at the memory of the browser's process tree and at how
+    # the recent send time compares with the first `window` sends after
+    # launch. A threshold of 0 turns that check off.
+    def __init__(self, max_rss_mb=1500, latency_factor=3.0, every=0, window=20):
+        self.max_rss_mb = max_rss_mb
+        self.latency_factor = latency_factor
+        self.every = every
+        self.window = window
+        self.launched()
+
+    def launched(self):
+        self.messages = 0
+        self.rss = 0
+        self.latencies = deque(maxlen=self.window)
+        self.baseline_latency = None
+
+    def observe(self, rss, seconds):
+        self.messages += 1
+        if rss:
+            self.rss = rss
+        self.latencies.append(seconds)
+        if self.baseline_latency is None and len(self.latencies) == self.window:
+            self.baseline_latency = median(self.latencies)
+
+    def describe(self):
+        parts = []
+        if self.max_rss_mb:
+            parts.append(f"memory above {self.max_rss_mb} MB")
+        if self.latency_factor:
+            parts.append(f"send time {self.latency_factor:g}x slower than after launch")
+        if self.every:
+            parts.append(f"every {self.every} messages")
+        return ", ".join(parts) or "never"
+
+    def reason(self):
+        # Why the browser should be restarted now, or ""
+        if self.max_rss_mb and self.rss > self.max_rss_mb * MB:
+            return f"memory {self.rss / MB:.0f} MB above {self.max_rss_mb} MB"
+        if self.latency_factor and self.baseline_latency and self.messages >= 2 * self.window:
+            recent = median(self.latencies)
+            if recent > self.latency_factor * self.baseline_latency:
+                return f"median send time {recent:.1f}s vs {self.baseline_latency:.1f}s after launch"
+        if self.every and self.messages >= self.every:
+            return f"{self.messages} messages since launch"
+        return ""
+
+# --- Rate Limiting ---
+
+class RateLimiter:
+    # Token bucket targeting `per_minute` messages, plus hard sliding-window caps
+    # per hour and per day. Send timestamps are persisted to disk so the caps
+    # still hold after the app is restarted.
+    def __init__(self, per_minute, per_hour, per_day, state_path=RATE_STATE_PATH, burst=1):
+        self.rate = per_minute / 60.0 # tokens per second
+        self.capacity = max(1, burst)
+        self.per_hour = per_hour
+        self.per_day = per_day
+        self.state_path = state_path
+        self.tokens = float(self.capacity)
+        self.last_refill = time.monotonic()
+        self.history = deque(self._load_history())
+
+    def _load_history(self):
+        try:
+            with open(self.state_path, "r") as f:
+                sent = json.load(f).get("sent", [])
+        except (OSError, ValueError):
+            return []
+        cutoff = time.time() - 86400
+        return sorted(ts for ts in sent if ts > cutoff)
+
+    def _save_history(self):
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"sent": list(self.history)}, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            debug(f"Could not save rate limit state: {e}")
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def _sent_since(self, cutoff):
+        # History is sorted, so count from the newest end
+        count = 0
+        for ts in reversed(self.history):
+            if ts <= cutoff:
+                break
+            count += 1
+        return count
+
+    def wait_time(self):
+        # Returns (seconds, reason) until the next send is allowed.
+        # reason is "rate", "hourly" or "daily"; seconds is 0 when allowed now.
+        now = time.time()
+        while self.history and self.history[0] <= now - 86400:
+            self.history.popleft()
+
+        if len(self.history) >= self.per_day:
+            return self.history[-self.per_day] + 86400 - now, "daily"
+        if self._sent_since(now - 3600) >= self.per_hour:
+            return self.history[-self.per_hour] + 3600 - now, "hourly"
+
+        self._refill()
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate, "rate"
+        return 0, None
+
+    def acquire(self, sleep=time.sleep, notify=None):
+        # Blocks until a send is allowed and takes a token for it. Time already
+        # spent on the previous send counts towards the wait, so throughput
+        # follows the configured rate regardless of page latency.
+        # Returns False instead of waiting when the daily cap is exhausted.
+        while True:
+            delay, reason = self.wait_time()
+            if delay <= 0:
+                break
+            if reason == "daily":
+                return False
+            if notify and reason == "hourly":
+                notify(f"Hourly cap of {self.per_hour} reached. Waiting {int(delay)}s...")
+            sleep(delay)
+        self.tokens -= 1
+        return True
+
+    def record_sent(self):
+        self.history.append(time.time())
+        self._save_history()
+
+# --- Run Control ---
+
+class StopRequested(BaseException):
+    # Derives from BaseException so the worker's broad `except Exception`
+    # handlers around individual steps don't swallow a stop request.
+    pass
+
+class BrowserHung(BaseException):
+    # Raised in the worker once the watchdog has killed a hung browser. A
+    # BaseException for the same reason as StopRequested.
+    pass
+
+# Resolves with the first element matching an XPath (or all of them) as
+# soon as one is in the DOM, or with null after the given milliseconds.
+# Mutations are batched so a busy page costs at most one lookup per frame.
+WAIT_SCRIPT = """
+const [xpath, all, visible, timeout, done] = arguments;
+const usable = (el) => !visible || (el.getClientRects().length > 0 && !el.disabled);
+const find = () => {
+    const result = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    const nodes = [];
+    for (let i = 0; i < result.snapshotLength; i++) {
+        if (usable(result.snapshotItem(i))) nodes.push(result.snapshotItem(i));
+    }
+    return nodes.length ? (all ? nodes : nodes[0]) : null;
+};
+const found = find();
+if (found) return done(found);
+let scheduled = false;
+const finish = (value) => { observer.disconnect(); clearTimeout(timer); done(value); };
+const observer = new MutationObserver(() => {
+    if (scheduled) return;
+    scheduled = true;
+    setTimeout(() => { scheduled = false; const found = find(); if (found) finish(found); }, 16);
+});
+observer.observe(document, {childList: true, subtree: true, attributes: true});
+const timer = setTimeout(() => finish(null), timeout);
+"""
+
+# Replaces the composer's content with the message through a synthetic
+# paste, which WhatsApp's editor handles like a real one: line breaks,
+# emoji and *markup* arrive as typed. execCommand is the fallback for
+# builds that ignore synthetic paste events. Resolves with whether the
+# composer's content changed to some text.
+INSERT_SCRIPT = """
+const [box, text, done] = arguments;
+const before = box.innerHTML; // A draft left from an earlier attempt
+const inserted = () => box.innerHTML !== before && (box.textContent.trim() !== "" || box.querySelector("img") !== null);
+box.focus();
+const range = document.createRange();
+range.selectNodeContents(box);
+const selection = window.getSelection();
+selection.removeAllRanges();
+selection.addRange(range);
+const data = new DataTransfer();
+data.setData("text/plain", text);
+box.dispatchEvent(new ClipboardEvent("paste", {clipboardData: data, bubbles: true, cancelable: true}));
+// The editor renders on its next tick
+setTimeout(() => {
+    if (!inserted()) document.execCommand("insertText", false, text);
+    setTimeout(() => done(inserted()), 0);
+}, 50);
+"""
+
+# Delivery tracking: TRACK_SCRIPT runs just before a send click and notes
+# the outgoing messages already in the chat; a MutationObserver then
+# records when the new message first shows each status icon.
+# HARVEST_SCRIPT reads the result just before the next navigation drops the
+# page. Labels cover English and Indonesian WhatsApp.
+TRACK_SCRIPT = """
+const statusOf = (row) => {
+    const icon = row.querySelector('[data-icon^="msg-"]');
+    if (!icon) return "";
+    const name = icon.getAttribute("data-icon");
+    const label = ((icon.closest("[aria-label]") || icon).getAttribute("aria-label") || "").trim().toLowerCase();
+    if (name.endsWith("-ack") || label === "read" || label === "dibaca") return "read";
+    if (name.startsWith("msg-dblcheck") || label === "delivered" || label === "diterima") return "delivered";
+    if (name.startsWith("msg-check") || label === "sent" || label === "terkirim") return "sent";
+    if (name.startsWith("msg-time") || label === "pending" || label === "tertunda") return "pending";
+    return "";
+};
+const idOf = (row) => (row.closest("[data-id]") || row).getAttribute("data-id") || "";
+const before = new Set(Array.from(document.querySelectorAll("div.message-out"), idOf));
+const started = performance.now();
+const tracker = {state: "", seen: {}};
+const update = () => {
+    const rows = Array.from(document.querySelectorAll("div.message-out")).filter((row) => !before.has(idOf(row)));
+    const state = rows.length ? statusOf(rows[rows.length - 1]) : "";
+    if (state && state !== tracker.state) {
+        tracker.state = state;
+        if (!(state in tracker.seen)) tracker.seen[state] = (performance.now() - started) / 1000;
+        if (tracker.onchange) tracker.onchange();
+    }
+};
+if (window.__blastTracker) window.__blastTracker.observer.disconnect();
+tracker.observer = new MutationObserver(update);
+tracker.observer.observe(document.body, {childList: true, subtree: true, attributes: true, attributeFilter: ["data-icon", "aria-label"]});
+window.__blastTracker = tracker;
+"""
+
+HARVEST_SCRIPT = """
+const tracker = window.__blastTracker;
+if (!tracker) return null;
+tracker.observer.disconnect();
+delete window.__blastTracker;
+return {state: tracker.state, seen: tracker.seen};
+"""
+
+# Resolves once the tracked message has left the clock state, i.e. an
+# attachment finished uploading; with "" after the given milliseconds, or
+# null when no tracker is running
+UPLOAD_SCRIPT = """
+const [timeout, done] = arguments;
+const tracker = window.__blastTracker;
+if (!tracker) return done(null);
+const uploaded = () => ["sent", "delivered", "read"].includes(tracker.state);
+if (uploaded()) return done(tracker.state);
+const timer = setTimeout(() => { tracker.onchange = null; done(""); }, timeout);
+tracker.onchange = () => {
+    if (!uploaded()) return;
+    tracker.onchange = null;
+    clearTimeout(timer);
+    done(tracker.state);
+};
+"""
+
+DELIVERY_STATES = ["pending", "sent", "delivered", "read"]
+
+class RunControl:
+    # Stop/pause state shared between the GUI and the worker. Every sleep and
+    # wait in the worker goes through here and re-checks the state at least
+    # every POLL_INTERVAL seconds.
+    POLL_INTERVAL = 0.2
+    # Longest single DOM wait in the browser (see wait_for). Stop/pause is
+    # only seen between waits, so this bounds how long they take to land.
+    WAIT_SLICE = 0.25
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._resume = threading.Event()
+        self._resume.set()
+        self._interrupt = None
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    @property
+    def paused(self):
+        return not self._resume.is_set()
+
+    def stop(self):
+        self._stop.set()
+        self._resume.set() # Release a paused worker so it can exit
+
+    def pause(self):
+        self._resume.clear()
+
+    def resume(self):
+        self._resume.set()
+
+    def interrupt(self, exc):
+        # Makes the worker's next check raise exc (see Watchdog)
+        self._interrupt = exc
+
+    def check(self):
+        # Blocks while paused and raises StopRequested once stopped.
+        # Returns how long we were held by a pause.
+        if self._interrupt is not None:
+            exc, self._interrupt = self._interrupt, None
+            raise exc
+        paused_for = 0.0
+        if self.paused:
+            start = time.monotonic()
+            while not self._resume.wait(self.POLL_INTERVAL):
+                pass
+            paused_for = time.monotonic() - start
+        if self._stop.is_set():
+            raise StopRequested()
+        return paused_for
+
+    def sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while True:
+            self.check()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._stop.wait(min(remaining, self.POLL_INTERVAL))
+
+    def wait_for(self, driver, timeout, xpath, all=False, visible=False):
+        # Waits for an element matching xpath without polling: WAIT_SCRIPT
+        # watches the DOM with a MutationObserver and answers as soon as it
+        # appears. Each call covers WAIT_SLICE seconds in one WebDriver
+        # command, after which stop/pause is checked. Returns the element
+        # (all: the list of them); time spent paused does not count.
+        deadline = time.monotonic() + timeout
+        while True:
+            deadline += self.check()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutException(f"No element matching {xpath} within {timeout}s")
+            try:
+                found = driver.execute_async_script(WAIT_SCRIPT, xpath, all, visible, int(min(remaining, self.WAIT_SLICE) * 1000))
+            except JavascriptException:
+                continue # The page navigated away mid-wait; look again on the new one
+            if found:
+                return found
+
+# --- Watchdog ---
+
+def process_tree(pid):
+    # pid and all its descendants, from /proc (just pid elsewhere)
+    if not os.path.isdir("/proc"):
+        return [pid]
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rpartition(")")[2].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids = []
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        stack.extend(children.get(current, []))
+    return pids
+
+class Watchdog:
+    # Times every WebDriver command from a supervising thread. A command
+    # still running after COMMAND_DEADLINE seconds means geckodriver or
+    # Firefox has hung: the watchdog kills the browser's process tree, which
+    # makes the blocked call fail, and interrupts the worker with
+    # BrowserHung so it can relaunch and carry on.
+    COMMAND_DEADLINE = 90 # Above the page load timeout set in launch_browser
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, control):
+        self.control = control
+        self._lock = threading.Lock()
+        self._command = None # (name, start time) of the command in flight
+        self.pids = [] # Processes to kill on a hang: geckodriver and Firefox
+        self.tripped = None # (command, seconds it hung for, when) after a kill
+        self.commands = 0 # WebDriver round trips, for the browser stats
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="webdriver-watchdog", daemon=True)
+        self._thread.start()
+
+    def attach(self, driver, pids):
+        # Routes the driver's commands through the watchdog
+        self.pids = pids
+        self.tripped = None
+        execute = driver.command_executor.execute
+        def timed_execute(command, params):
+            with self._lock:
+                self._command = (command, time.monotonic())
+                self.commands += 1
+            try:
+                return execute(command, params)
+            finally:
+                with self._lock:
+                    self._command = None
+        driver.command_executor.execute = timed_execute
+
+    def _watch(self):
+        while not self._done.wait(self.CHECK_INTERVAL):
+            with self._lock:
+                command = self._command
+            if command is None or self.tripped:
+                continue
+            hung_for = time.monotonic() - command[1]
+            if hung_for > self.COMMAND_DEADLINE:
+                self.tripped = (command[0], hung_for, time.monotonic())
+                # Interrupt first: the kill makes the worker's call fail at
+                # once, and recover_browser must find the interrupt already
+                # set when it clears it, or it would fire in the relaunch
+                self.control.interrupt(BrowserHung())
+                self.kill()
+
+    def kill(self):
+        for pid in self.pids:
+            if not pid:
+                continue
+            for child in reversed(process_tree(pid)):
+                try:
+                    os.kill(child, signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def close(self):
+        self._done.set()
+
+# --- Upload Timing ---
+
+class UploadEstimator:
+    # How long to wait for an attachment to upload. Keeps an exponentially
+    # weighted average of the upload throughput seen so far (seeded from the
+    # last run) and allows SLACK times the expected time plus LATENCY for
+    # WhatsApp's own processing, within [MIN_TIMEOUT, MAX_TIMEOUT].
+    DEFAULT_BYTES_PER_SECOND = 128 * 1024 # A slow mobile uplink, until measured
+    SMOOTHING = 0.3
+    LATENCY = 5.0
+    SLACK = 3.0
+    MIN_TIMEOUT = 10.0
+    MAX_TIMEOUT = 300.0
+
+    def __init__(self, bytes_per_second=None):
+        self.bytes_per_second = bytes_per_second or self.DEFAULT_BYTES_PER_SECOND
+        self.measured = bool(bytes_per_second)
+
+    def timeout(self, size):
+        expected = self.LATENCY + size / self.bytes_per_second
+        return min(self.MAX_TIMEOUT, max(self.MIN_TIMEOUT, self.SLACK * expected))
+
+    def observe(self, size, seconds):
+        rate = size / max(seconds, 0.1)
+        if self.measured:
+            rate = self.SMOOTHING * rate + (1 - self.SMOOTHING) * self.bytes_per_second
+        self.bytes_per_second = rate
+        self.measured = True
+
+# --- Row Preparation ---
+
+class RowPreparer:
+    # Prepares rows (phone, rendered message, chat link) on a background
+    # thread while the browser works on earlier ones, at most AHEAD rows in
+    # front of it. The send loop takes rows by position and prepares one
+    # inline if the preparer hasn't reached it, e.g. a row re-queued after
+    # a hang, so the preparer never decides what gets sent.
+    AHEAD = 20
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.ready = {} # position -> prepared row
+        self.ahead = 0 # Rows prepared but not yet taken
+        self.cond = threading.Condition()
+        self.done = False
+        self.hits = 0 # Rows the send loop found already prepared
+        self.thread = threading.Thread(target=self._run, name="RowPreparer", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        index = 0
+        while True:
+            with self.cond:
+                while not self.done and self.ahead >= self.AHEAD:
+                    self.cond.wait()
+                if self.done:
+                    return
+            with self.engine.queue_lock:
+                pos = self.engine.positions[index] if index < len(self.engine.positions) else None
+            if pos is None:
+                with self.cond:
+                    self.cond.wait(0.5) # Rows may still arrive through extend
+                continue
+            index += 1
+            prepared = self.engine.prepare_row(pos)
+            with self.cond:
+                if pos not in self.ready:
+                    self.ready[pos] = prepared
+                    self.ahead += 1
+
+    def take(self, pos):
+        with self.cond:
+            prepared = self.ready.pop(pos, None)
+            if prepared is not None:
+                self.ahead -= 1
+                self.hits += 1
+                self.cond.notify()
+                return prepared
+        return self.engine.prepare_row(pos)
+
+    def close(self):
+        with self.cond:
+            self.done = True
+            self.cond.notify()
+
+# --- Sending Engine ---
+
+class BlastEngine:
+    # Drives Firefox through one campaign. Knows nothing about Qt: progress
+    # and per-row statuses are reported through the on_progress(value,
+    # message) and on_status(position, status, reason) callbacks, and
+    # on_saving() once sending is over and only the results remain to write.
+    def __init__(self, df, positions, message_template, image_path, rate_limiter, max_messages,
+                 profile_path="", headless=False, result_writer=None, quit_browser=False,
+                 clone_profile=False, lean_browser=False, recycle=None, on_progress=None, on_status=None,
+                 on_saving=None):
+        self.df = df
+        self.positions = list(positions) # Row positions in df to send to, in order
+        self.queue_lock = threading.Lock()
+        self.message_template = message_template
+        self.image_path = image_path
+        self.rate_limiter = rate_limiter
+        self.max_messages = max_messages
+        self.profile_path = profile_path
+        self.clone_profile = clone_profile # Launch from a trimmed copy (see ProfileClone)
+        self.profile_clone = None
+        self.headless = headless
+        self.lean_browser = lean_browser # LEAN_PREFS and an eager page load strategy
+        self.recycle = recycle or RecyclePolicy()
+        self.restarts = [] # (message number, reason) per browser restart
+        self.result_writer = result_writer
+        self.quit_browser = quit_browser
+        self.on_progress = on_progress or (lambda value, message: None)
+        self.on_status = on_status or (lambda pos, status, reason: None)
+        self.on_saving = on_saving or (lambda: None)
+        self.control = RunControl()
+        self.started_at = {} # position -> time the latest attempt started
+        self.attempts = {} # position -> number of send attempts
+        self.finished_rows = set()
+        self.browser_pid = None
+        self.peak_rss = 0
+        self.send_seconds = [] # Duration of each successful send
+        self.memory_trend = [] # (message number, RSS in MB) after each send
+        self.watchdog = None
+        self.step = "" # What the current row is doing, for hang reports
+        self.sent_part = "" # What of the current row may already be out, so a hang can't re-queue it
+        self.hangs = [] # (step, command, seconds hung, seconds to recover)
+        self.hang_retries = {} # position -> times re-queued after a hang
+        self.retried = 0 # Re-queued entries in positions
+        self.template_fields = []
+        self.tracked_pos = None # Row whose send the page is tracking
+        self.awaiting_delivery = None # (position, reason, finished at) of a sent row whose delivery isn't read yet
+        self.deliveries = [] # (state, seconds until the server accepted it or None) per tracked send
+        self.uploads = UploadEstimator(load_browser_stats().get("upload_bytes_per_second"))
+        self.preparer = None
+
+    TERMINAL_STATUSES = ("sent", "failed", "skipped")
+
+    def set_row_status(self, pos, status, reason=""):
+        # Updates the preview and, once a row is done, streams its result
+        now = time.time()
+        if status == "sending":
+            self.started_at[pos] = now
+            self.attempts[pos] = self.attempts.get(pos, 0) + 1
+        self.on_status(pos, status, reason)
+        if status == "sent" and pos in self.started_at:
+            self.send_seconds.append(now - self.started_at[pos])
+            rss = self.sample_memory()
+            if rss:
+                self.memory_trend.append((len(self.send_seconds), round(rss / MB)))
+            self.recycle.observe(rss, self.send_seconds[-1])
+        if status in self.TERMINAL_STATUSES:
+            self.finished_rows.add(pos)
+            if status == "sent" and pos == self.tracked_pos:
+                # Journaled now so a crash can't lose the send; the line
+                # harvest_delivery writes with the status the message reached
+                # replaces it in the results file
+                self.awaiting_delivery = (pos, reason, now)
+                self.write_result(pos, status, reason, now, delivery="checking", final=False)
+            else:
+                self.write_result(pos, status, reason, now)
+        if pos == self.tracked_pos:
+            self.tracked_pos = None
+
+    def track_delivery(self, driver, pos):
+        # Starts watching the message about to be sent. Tracking is only a
+        # report, so it never fails the row.
+        try:
+            driver.execute_script(TRACK_SCRIPT)
+            self.tracked_pos = pos
+            return True
+        except Exception as e:
+            debug(f"Delivery tracking not started: {e}")
+            return False
+
+    def wait_for_upload(self, driver, size):
+        # Waits until the attachment just sent leaves the clock state, for up
+        # to the estimator's timeout. Returns (seconds taken or None if not
+        # confirmed, timeout). Paused time counts for neither.
+        timeout = self.uploads.timeout(size)
+        start = time.monotonic()
+        deadline = start + timeout
+        while True:
+            paused_for = self.control.check()
+            deadline += paused_for
+            start += paused_for
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, timeout
+            state = driver.execute_async_script(UPLOAD_SCRIPT, int(min(remaining, RunControl.WAIT_SLICE) * 1000))
+            if state is None:
+                return None, timeout # Tracker gone (page changed); nothing left to watch
+            if state:
+                seconds = time.monotonic() - start
+                self.uploads.observe(size, seconds)
+                return seconds, timeout
+
+    def harvest_delivery(self, driver):
+        # Reads the status the last sent message reached and journals it as
+        # a second line for its row. Must run before anything navigates the
+        # page away.
+        if self.awaiting_delivery is None:
+            return
+        pos, reason, finished_at = self.awaiting_delivery
+        self.awaiting_delivery = None
+        result = None
+        if driver is not None:
+            try:
+                result = driver.execute_script(HARVEST_SCRIPT)
+            except Exception as e:
+                debug(f"Delivery status not read: {e}")
+        state = (result or {}).get("state") or "unknown"
+        seen = (result or {}).get("seen") or {}
+        # Seconds until the clock turned into a tick, i.e. the message left the outbox
+        accepted = min([seconds for name, seconds in seen.items() if name != "pending"], default=None)
+        self.deliveries.append((state, accepted))
+        delivery = f"Delivery: {state}" + (f" after {accepted:.1f}s" if accepted is not None else "")
+        self.on_status(pos, "sent", f"{reason}; {delivery}" if reason else delivery)
+        self.write_result(pos, "sent", reason, finished_at, delivery=state)
+
+    def write_result(self, pos, status, reason, finished_at=None, delivery="", final=True):
+        # final=False journals the line but lets the row's next line replace
+        # it in the results file (see ResultWriter)
+        if self.result_writer is None:
+            return
+        started = self.started_at.get(pos)
+        # Cell by cell: a row Series would upcast int64 phones to float
+        # when the other loaded columns are numeric
+        df = self.df
+        self.result_writer.write([df.iat[pos, i] for i in range(df.shape[1])] + [
+            status,
+            reason,
+            self.attempts.get(pos, 0),
+            format_time(started) if started else None,
+            format_time(finished_at) if finished_at else None,
+            delivery,
+        ], key=pos, final=final)
+
+    def close_results(self):
+        self.harvest_delivery(None) # Unread when the browser is gone
+        if self.result_writer is None:
+            return
+        self.on_saving()
+        # Rows never reached (stop, caps, max messages) are listed as pending.
+        # There can be most of a large sheet of them, so their cells are
+        # taken column by column; object arrays keep int64 phones as ints.
+        pending = [pos for pos in dict.fromkeys(self.positions) if pos not in self.finished_rows] # Rows retried after a hang appear twice
+        rows = self.df.iloc[pending]
+        columns = [rows.iloc[:, i].to_numpy(dtype=object) for i in range(rows.shape[1])]
+        for pos, cells in zip(pending, zip(*columns) if columns else [()] * len(pending)):
+            started = self.started_at.get(pos)
+            self.result_writer.write(list(cells) + [
+                "pending", "", self.attempts.get(pos, 0), format_time(started) if started else None, None, "",
+            ])
+        error = self.result_writer.close()
+        if error:
+            self.on_progress(100, f"Results export failed: {error}")
+        else:
+            self.on_progress(100, f"Results saved to {self.result_writer.path}")
+
+    def launch_browser(self, progress=None):
+        # Starts Firefox on WhatsApp Web and waits for the login. Restarts
+        # reuse the same profile (or clone), so the session carries over.
+        # `progress` overrides the progress values used for the first launch.
+        step = lambda value: value if progress is None else progress
+        options = Options()
+        if self.headless:
+            options.add_argument("-headless")
+        if self.lean_browser:
+            for name, value in LEAN_PREFS.items():
+                options.set_preference(name, value)
+            # driver.get returns at DOMContentLoaded; we wait for the
+            # elements we need anyway
+            options.page_load_strategy = "eager"
+        
+        # Handle Profile
+        # If user selected a specific profile folder, we use it.
+        # e.g. ~/.mozilla/firefox/xxxxx.default
+        if self.has_profile:
+            launch_path = self.profile_path
+            if self.clone_profile:
+                if self.profile_clone is None:
+                    start = time.perf_counter()
+                    self.profile_clone = ProfileClone(self.profile_path)
+                    self.profile_clone.create()
+                    self.on_progress(step(2), f"Copied login data ({self.profile_clone.size / MB:.1f} MB) to {self.profile_clone.path} in {time.perf_counter() - start:.2f}s")
+                launch_path = self.profile_clone.path
+            options.add_argument("-profile")
+            options.add_argument(launch_path)
+        
+        service = Service(GeckoDriverManager().install())
+        driver = webdriver.Firefox(service=service, options=options)
+        self.browser_pid = driver.capabilities.get("moz:processID")
+        # Bound every command: page loads by Firefox itself, everything else
+        # by the watchdog, with the HTTP timeout as a last resort
+        driver.set_page_load_timeout(60)
+        driver.command_executor.client_config.timeout = Watchdog.COMMAND_DEADLINE + 60
+        self.watchdog.attach(driver, [service.process.pid, self.browser_pid])
+        
+        self.on_progress(step(5), "Opening WhatsApp Web...")
+        driver.get("https://web.whatsapp.com")
+        
+        self.on_progress(step(10), "Please scan QR code if not logged in. Waiting for 30s...")
+        try:
+            # Wait for main element to ensure login
+            self.control.wait_for(driver, 60, '//div[@contenteditable="true"][@data-tab="3"]')
+            self.on_progress(step(15), "Logged in successfully!")
+            rss = self.sample_memory()
+            if rss:
+                self.on_progress(step(15), f"Firefox memory after login: {rss / MB:.0f} MB")
+        except TimeoutException:
+            self.on_progress(step(15), "Login wait timed out. Attempting to proceed (Manual check needed if QR still there).")
+        self.recycle.launched()
+        return driver
+
+    @property
+    def has_profile(self):
+        return bool(self.profile_path) and os.path.exists(self.profile_path)
+
+    def recycle_browser(self, driver, progress):
+        # Restarts Firefox between rows when the recycle policy asks for it.
+        # Without a saved profile a restart would need a new QR scan, so the
+        # run just carries on.
+        reason = self.recycle.reason()
+        if not reason:
+            return driver
+        if not self.has_profile:
+            if not self.restarts:
+                self.on_progress(progress, f"Browser restart needed ({reason}) but a temporary session would need a new QR scan; continuing.")
+                self.restarts.append((len(self.send_seconds), f"skipped: {reason}"))
+            return driver
+        self.on_progress(progress, f"Restarting browser: {reason}...")
+        self.restarts.append((len(self.send_seconds), reason))
+        start = time.perf_counter()
+        self.harvest_delivery(driver)
+        driver.quit()
+        driver = self.launch_browser(progress)
+        self.on_progress(progress, f"Browser restarted in {time.perf_counter() - start:.1f}s.")
+        return driver
+
+    def recover_browser(self, driver, index, pos, progress):
+        # Relaunches Firefox after the watchdog killed it. The interrupted row
+        # is queued again unless part of it may already be out (sent_part),
+        # as a retry would send that part twice.
+        command, hung_for, killed_at = self.watchdog.tripped
+        step = self.step
+        self.harvest_delivery(None) # The page is gone with the browser
+        try:
+            driver.quit()
+        except Exception:
+            pass # Already killed
+        for attempt in range(3):
+            self.control.interrupt(None) # Clear the BrowserHung that got us here
+            try:
+                driver = self.launch_browser(progress)
+                break
+            except BrowserHung:
+                continue # Hung again while starting; the watchdog killed it
+            except Exception:
+                if attempt == 2:
+                    raise
+        else:
+            raise RuntimeError("Browser kept hanging while restarting")
+        recovered_in = time.monotonic() - killed_at
+        self.hangs.append((step, command, hung_for, recovered_in))
+        self.on_progress(progress, f"Browser stopped responding while {step} ({command} hung for {hung_for:.0f}s). Killed and relaunched in {recovered_in:.1f}s.")
+        if self.sent_part:
+            self.set_row_status(pos, "failed", f"Browser hung when {self.sent_part} could already be sent; not retried to avoid a duplicate")
+        elif self.hang_retries.get(pos, 0) >= 1:
+            self.set_row_status(pos, "failed", "Browser hung twice on this row")
+        else:
+            self.hang_retries[pos] = self.hang_retries.get(pos, 0) + 1
+            with self.queue_lock:
+                self.positions.insert(index + 1, pos)
+            self.retried += 1
+            self.set_row_status(pos, "pending", "Retrying after a browser hang")
+        return driver
+
+    def prepare_row(self, pos):
+        # (phone, message, chat link, error) for one row, without touching
+        # the browser. Runs on the RowPreparer thread.
+        # Cells are read per column; see write_result
+        df = self.df
+        phone = phone_text(df['Phone'].iat[pos]) if 'Phone' in df.columns else ""
+        if not phone:
+            return "", "", "", ""
+        try:
+            # Simple template replacement
+            msg = self.message_template
+            for col in self.template_fields:
+                val = str(df[col].iat[pos])
+                msg = msg.replace(f"{{{col}}}", val)
+        except Exception as e:
+            return phone, "", "", f"Template error: {e}"
+        # The text goes in through the composer (insert_text), so it is not
+        # bound by URL length or mangled by URL encoding
+        return phone, msg, f"https://web.whatsapp.com/send?phone={urllib.parse.quote(phone)}", ""
+
+    def insert_text(self, driver, input_box, text):
+        # Puts the whole message into the composer in one command, replacing
+        # any draft. Falls back to typing it, with Shift+Enter for line
+        # breaks, if the page ignored both the paste and execCommand.
+        if driver.execute_async_script(INSERT_SCRIPT, input_box, text):
+            return
+        debug("Composer ignored the paste; typing the message instead")
+        lines = text.split("\n")
+        typed = lines[0]
+        for line in lines[1:]:
+            typed += Keys.SHIFT + Keys.ENTER + Keys.NULL + line
+        input_box.send_keys(typed)
+
+    def run(self):
+        # Sends the whole queue. Returns normally when done or stopped and
+        # raises if the browser can't be started.
+        driver = None
+        self.watchdog = Watchdog(self.control)
+        try:
+            self.on_progress(0, "Initializing Firefox Driver...")
+            if self.has_profile:
+                self.on_progress(2, f"Using profile: {os.path.basename(self.profile_path)}")
+            self.template_fields = template_columns(self.message_template, self.df.columns)
+            # Rows get prepared while Firefox starts and the user scans the QR code
+            self.preparer = RowPreparer(self)
+            driver = self.launch_browser()
+
+            # The image is the same for every row, so check it once
+            image_path = self.image_path if self.image_path and os.path.exists(self.image_path) else ""
+            image_size = os.path.getsize(image_path) if image_path else 0
+            
+            # positions can grow while we run (see extend), so re-check each time
+            for index in itertools.count():
+                with self.queue_lock:
+                    if index >= len(self.positions):
+                        break
+                    pos = self.positions[index]
+                done = index - self.retried # Retries don't count as new messages
+                total_messages = min(len(self.positions) - self.retried, self.max_messages)
+                if done >= self.max_messages:
+                    self.on_progress(100, f"Reached limit of {self.max_messages} messages.")
+                    break
+                driver = self.recycle_browser(driver, int((done/total_messages)*100))
+
+                phone, msg, link, error = self.preparer.take(pos)
+                if not phone:
+                    self.on_progress(int((done/total_messages)*100), f"Skipping row {index+1}: No Phone number")
+                    self.set_row_status(pos, "skipped", "No phone number")
+                    continue
+                if error:
+                    self.on_progress(int((done/total_messages)*100), f"Error formatting message for {phone}: {error}")
+                    self.set_row_status(pos, "failed", error)
+                    continue
+
+                # Pace sends according to the configured rate and caps
+                if not self.rate_limiter.acquire(sleep=self.control.sleep, notify=lambda m: self.on_progress(int((done/total_messages)*100), m)):
+                    self.on_progress(int((done/total_messages)*100), f"Daily cap of {self.rate_limiter.per_day} messages reached. Stopping.")
+                    break
+
+                self.on_progress(int((done/total_messages)*100), f"Sending to {phone}...")
+                self.set_row_status(pos, "sending", "")
+                
+                try:
+                    # 1. Open Chat
+                    self.step = f"opening the chat for {phone}"
+                    self.sent_part = ""
+                    self.harvest_delivery(driver) # Last chance before the page changes
+                    driver.get(link)
+                    
+                    # Wait for chat to load (input box available)
+                    input_box_xpath = '//div[@contenteditable="true"][@data-tab="10"]'
+                    try:
+                        self.control.wait_for(driver, 20, input_box_xpath)
+                    except TimeoutException:
+                        self.on_progress(int((done/total_messages)*100), f"Failed to load chat for {phone}. Number might be invalid.")
+                        self.set_row_status(pos, "failed", "Chat did not load (invalid number?)")
+                        continue
+
+                    row_note = ""
+                    
+                    # 2. Attach Image if exists
+                    if image_path:
+                        self.step = f"attaching the image for {phone}"
+                        try:
+                            # Click attach button (New: Plus icon, Old: Clip icon)
+                            attach_xpath = '//span[@data-icon="plus-rounded"] | //div[@title="Attach"] | //span[@data-icon="clip"]'
+                            attach_btn = self.control.wait_for(driver, 15, attach_xpath)
+                            # Wait a bit for UI to settle (to avoid menu closing immediately if still loading)
+                            self.control.sleep(1)
+                            
+                            # Use JavaScript Click for Attach button to avoid interception
+                            driver.execute_script("arguments[0].click();", attach_btn)
+                            # No wait for the menu animation: wait_for below
+                            # returns once its items are in the DOM, and a
+                            # script click works mid-animation
+                            
+                            # Explicitly CLICK "Photos & Videos" button
+                            debug("Clicking 'Photos & Videos' button...")
+                            try:
+                                # Updated Robust XPaths based on HTML analysis
+                                photo_video_xpath = (
+                                    '//*[contains(text(), "Foto & Video")] | '         
+                                    '//*[contains(text(), "Photos & Videos")] | '
+                                    '//*[local-name()="svg"]/*[local-name()="title"][text()="ic-filter-filled"]/ancestor::div[@role="button"] | '
+                                    '//*[local-name()="svg"]/*[local-name()="title"][text()="ic-filter-filled"]/ancestor::li'
+                                )
+                                
+                                # Wait for elements
+                                buttons = self.control.wait_for(driver, 5, photo_video_xpath, all=True)
+                                
+                                target_btn = None
+                                for btn in buttons:
+                                    # Safety Check: ensure we don't click Sticker
+                                    # Get outer HTML to check for "Sticker" keyword nearby
+                                    try:
+                                        # Go up a few levels to check context
+                                        context_html = btn.find_element(By.XPATH, "./../..").get_attribute('outerHTML')
+                                        if "Stiker" in context_html or "Sticker" in context_html or "wds-ic-sticker" in context_html:
+                                            continue
+                                    except:
+                                        pass
+                                        
+                                    target_btn = btn
+                                    break
+                                
+                                if target_btn:
+                                    debug("Found Photo/Video button via text/icon match.")
+                                    driver.execute_script("arguments[0].click();", target_btn)
+                                else:
+                                    # Fallback: Just click the 2nd item in the list (index 1) if strictly safe
+                                    debug("Text/Icon match suspect. Trying fallback to 2nd list item...")
+                                    fallback_xpath = '//ul/li[2]//div[@role="button"]'
+                                    fallback_btn = driver.find_element(By.XPATH, fallback_xpath)
+                                    driver.execute_script("arguments[0].click();", fallback_btn)
+
+                                try:
+                                    # Wait for the input to spawn
+                                    self.control.wait_for(driver, 2, '//input[@type="file"][contains(@accept, "video")]')
+                                except TimeoutException:
+                                    pass # Fall back to whatever input exists
+                                
+                            except Exception as e:
+                                debug(f"Failed to click Photo/Video button: {e}")
+                                # DEBUG: Dump the menu HTML to see what's wrong
+                                try:
+                                    menu = driver.find_element(By.XPATH, '//ul')
+                                    debug("--- DUMPING MENU HTML FOR DEBUGGING ---")
+                                    debug(menu.get_attribute('outerHTML')[:500]) # Print first 500 chars
+                                    debug("--- END DUMP ---")
+                                except:
+                                    debug("Could not dump menu HTML.")
+                                # raise e # Do not raise, let it try to find input anyway
+
+                            # Find the file input that accepts VIDEO (identifies Photo/Video input)
+                            inputs = driver.find_elements(By.XPATH, '//input[@type="file"]')
+                            target_input = None
+                            
+                            for inp in inputs:
+                                accept = inp.get_attribute('accept')
+                                if accept and 'video' in accept:
+                                    target_input = inp
+                                    break
+                            
+                            # Fallback: Just take the last input spawned
+                            if not target_input and inputs:
+                                target_input = inputs[-1]
+                            
+                            if target_input:
+                                target_input.send_keys(image_path)
+                            else:
+                                raise Exception("No file input found after clicking Photos & Videos.")
+                            
+                            # Wait for preview and send button (Image/Doc)
+                            
+                            # Wait for preview and send button (Image/Doc)
+                            # CRITICAL: Wait for the image/doc to actually load in the preview modal
+                            
+                            # Multiple selectors for the Send button in the preview modal
+                            # 1. Standard icon spans
+                            # 2. The green circle button wrapper (usually has aria-label="Send" or "Kirim")
+                            # 3. The specific class provided by user (risky if dynamic, but added as fallback)
+                            
+                            send_xpath = (
+                                '//span[@data-icon="send"] | '
+                                '//span[@data-icon="wds-ic-send-filled"] | '
+                                '//span[@data-icon="send-light"] | '
+                                '//div[@aria-label="Send"] | '
+                                '//div[@aria-label="Kirim"] | '
+                                '//div[contains(@class, "x1ey2m1c") and @role="button"]' # Adjusted to look for button role
+                            )
+                            
+                            # Increased wait time and specific condition
+                            send_btn_img = self.control.wait_for(driver, 15, send_xpath)
+                            
+                            # Force wait for animation/overlay to clear
+                            self.control.sleep(2)
+                            
+                            # Use JavaScript Click for Image Send. Tracking its
+                            # delivery also tells us when the upload is done.
+                            tracked = self.track_delivery(driver, pos)
+                            # From here a retry could send the image twice
+                            self.step = f"sending the image to {phone}"
+                            self.sent_part = "the image"
+                            driver.execute_script("arguments[0].click();", send_btn_img)
+                            
+                            # Wait for upload: navigating away too early loses the attachment
+                            if tracked:
+                                seconds, timeout = self.wait_for_upload(driver, image_size)
+                                if seconds is None:
+                                    self.on_progress(int((done/total_messages)*100), f"Image upload to {phone} not confirmed within {timeout:.0f}s")
+                                    row_note = f"Image upload not confirmed within {timeout:.0f}s"
+                                else:
+                                    debug(f"Image uploaded in {seconds:.1f}s (timeout {timeout:.0f}s)")
+                            else:
+                                self.control.sleep(3)
+                            
+                        except Exception as e:
+                             self.control.check() # A kill by the watchdog is a hang, not an image error
+                             self.on_progress(int((done/total_messages)*100), f"Error sending image to {phone}: {e}")
+                             row_note = f"Image not sent: {e}"
+                    
+                    # 3. Send Text Message
+                    # The text goes into the composer in one paste, then we
+                    # find the send button (now in main chat view) and click it.
+                    if msg:
+                        self.step = f"typing the text for {phone}"
+                        try:
+                            input_box = self.control.wait_for(driver, 10, input_box_xpath)
+                            self.insert_text(driver, input_box, msg)
+                        except TimeoutException:
+                            row_note = "Text not sent: chat input disappeared"
+                            msg = ""
+                    self.control.check() # Don't press send on a browser the watchdog just killed
+                    self.step = f"sending the text to {phone}"
+                    if msg: # Else there is nothing to send beyond the image
+                        self.sent_part = "the image and the text" if self.sent_part else "the text"
+                        self.track_delivery(driver, pos)
+                        try:
+                            self.on_progress(int((done/total_messages)*100), f"Sending text to {phone}...")
+                        
+                            send_xpath = '//span[@data-icon="send"] | //span[@data-icon="wds-ic-send-filled"] | //span[@data-icon="send-light"] | //button[@aria-label="Send"]'
+                            # Reduced timeout as button should be there if text is present
+                            send_btn = self.control.wait_for(driver, 5, send_xpath, visible=True)
+                            driver.execute_script("arguments[0].click();", send_btn)
+                        except Exception:
+                            self.control.check() # A kill by the watchdog is a hang, not a missing button
+                            # Fallback: Press Enter on the active element (the input box)
+                            # self.on_progress(int((done/total_messages)*100), f"Click failed, trying ENTER key for {phone}...")
+                            try:
+                                 driver.switch_to.active_element.send_keys(Keys.ENTER)
+                            except Exception as ex:
+                                 self.on_progress(int((done/total_messages)*100), f"Failed to send text to {phone}: {ex}")
+                                 row_note = f"Text not sent: {ex}"
+                    
+                    self.control.check()
+                    self.rate_limiter.record_sent()
+                    self.on_progress(int(((done+1)/total_messages)*100), f"Sent to {phone}")
+                    self.set_row_status(pos, "sent", row_note)
+
+                except BrowserHung:
+                    driver = self.recover_browser(driver, index, pos, int((done/total_messages)*100))
+                except Exception as e:
+                    if self.watchdog.tripped:
+                        # The killed browser made a call fail before any check ran
+                        driver = self.recover_browser(driver, index, pos, int((done/total_messages)*100))
+                        continue
+                    self.on_progress(int((done/total_messages)*100), f"Failed to send to {phone}: {e}")
+                    self.set_row_status(pos, "failed", str(e))
+                finally:
+                    self.step = ""
+
+            debug(f"{self.preparer.hits} rows were prepared ahead of the browser")
+            self.on_progress(100, "Automation Complete!")
+            
+        except StopRequested:
+            pass # Callers check control.stopped to report the stop
+        except BrowserHung:
+            # Hung outside a row (first launch or a recycle restart)
+            command, hung_for, _ = self.watchdog.tripped
+            raise RuntimeError(f"Firefox stopped responding ({command} hung for {hung_for:.0f}s)") from None
+        finally:
+            if driver:
+                if not self.control.stopped and (not self.quit_browser or self.awaiting_delivery):
+                    time.sleep(5) # Leave the last chat on screen, and give its message time to deliver
+                self.harvest_delivery(driver)
+            self.close_results()
+            self.report_deliveries()
+            if driver:
+                self.report_browser_stats()
+                # A cloned profile is disposable, so its browser always closes
+                if self.quit_browser or self.profile_clone:
+                    try:
+                        driver.quit()
+                    except Exception:
+                        pass # Already gone, e.g. a restart failed to launch
+
+            if self.profile_clone:
+                self.finish_profile_clone(synced=driver is not None)
+            self.watchdog.close()
+            if self.preparer:
+                self.preparer.close()
+
+    def sample_memory(self):
+        rss = process_tree_rss(self.browser_pid)
+        if rss:
+            self.peak_rss = max(self.peak_rss, rss)
+        return rss
+
+    def report_deliveries(self):
+        # Separates messages that left the outbox from ones still showing
+        # the clock when we moved on
+        if not self.deliveries:
+            return
+        counts = {}
+        for state, _ in self.deliveries:
+            counts[state] = counts.get(state, 0) + 1
+        line = ", ".join(f"{counts[state]} {state}" for state in DELIVERY_STATES + ["unknown"] if state in counts)
+        accepted = sorted(seconds for _, seconds in self.deliveries if seconds is not None)
+        if accepted:
+            line += f"; median {accepted[len(accepted) // 2]:.1f}s until sent"
+        self.on_progress(100, f"Delivery status when moving on: {line}")
+
+    def report_browser_stats(self):
+        # Logs memory and per-message time for this run next to the last run
+        # in the other browser mode, so lean and default prefs can be compared
+        mode = "lean" if self.lean_browser else "default"
+        if not self.send_seconds:
+            return
+        current = {
+            "peak_rss_mb": round(self.peak_rss / MB) if self.peak_rss else None,
+            "seconds_per_message": round(sum(self.send_seconds) / len(self.send_seconds), 2),
+            "commands_per_message": round(self.watchdog.commands / len(self.send_seconds), 1),
+            "messages": len(self.send_seconds),
+            "recycle_policy": self.recycle.describe(),
+            "restarts": [{"after_message": n, "reason": reason} for n, reason in self.restarts],
+            "hangs": [{"step": step, "command": command, "hung_s": round(hung_for, 1), "recovered_s": round(recovered_in, 1)}
+                      for step, command, hung_for, recovered_in in self.hangs],
+            # Every 10th sample keeps long runs readable
+            "rss_trend_mb": self.memory_trend[::10] + self.memory_trend[-1:],
+            "at": format_time(time.time()),
+        }
+        stats = load_browser_stats()
+        stats[mode] = current
+        if self.uploads.measured:
+            stats["upload_bytes_per_second"] = round(self.uploads.bytes_per_second)
+        save_browser_stats(stats)
+        line = f"{mode.capitalize()} browser: {current['seconds_per_message']}s and {current['commands_per_message']} WebDriver commands per message"
+        if current["peak_rss_mb"]:
+            line += f", peak memory {current['peak_rss_mb']} MB"
+        other = stats.get("default" if mode == "lean" else "lean")
+        if other:
+            line += f" (last {'default' if mode == 'lean' else 'lean'} run: {other['seconds_per_message']}s"
+            line += f", {other['peak_rss_mb']} MB)" if other.get("peak_rss_mb") else ")"
+        self.on_progress(100, line)
+        launched_at = max([n for n, reason in self.restarts if not reason.startswith("skipped")], default=0)
+        trend = [sample for sample in self.memory_trend if sample[0] > launched_at]
+        if trend:
+            first, last = trend[0], trend[-1]
+            line = f"Memory trend since the last launch: {first[1]} MB after message {first[0]}, {last[1]} MB after message {last[0]}"
+            if last[0] > first[0]:
+                line += f" ({(last[1] - first[1]) * 100 / (last[0] - first[0]):+.0f} MB per 100 messages)"
+            self.on_progress(100, line)
+        restarts = "; ".join(f"after message {n}: {reason}" for n, reason in self.restarts) or "none"
+        self.on_progress(100, f"Browser restarts ({self.recycle.describe()}): {restarts}")
+        if self.hangs:
+            hangs = "; ".join(f"{command} while {step}, hung {hung_for:.0f}s, back in {recovered_in:.1f}s"
+                              for step, command, hung_for, recovered_in in self.hangs)
+            self.on_progress(100, f"Browser hangs: {hangs}")
+
+    def finish_profile_clone(self, synced):
+        # Keeps a login (re)made in the clone, then deletes the clone
+        if synced:
+            error = self.profile_clone.sync_back()
+            self.on_progress(100, error or "Synced WhatsApp login data back to the profile.")
+        self.profile_clone.remove()
+        self.profile_clone = None
+
+    def extend(self, df, positions):
+        # Queues rows appended to the sheet mid-run. df must contain the
+        # current rows unchanged, with the new ones after them.
+        with self.queue_lock:
+            self.df = df
+            self.positions.extend(positions)
+
+    def stop(self):
+        self.control.stop()
+
+    def pause(self):
+        self.control.pause()
+
+    def resume(self):
+        self.control.resume()
+
+# --- Engine Process ---
+
+def serve(conn, options):
+    # Entry point of the engine process the GUI starts (see engine_process.py
+    # and SenderWorker in main.py), so a crash or a long pandas step here
+    # never touches the GUI. Everything goes over one multiprocessing pipe as small tuples:
+    #   to the GUI:  ("progress", value, message), ("status", pos, status, reason),
+    #                ("saving",) when only the results file is left to write,
+    #                and last ("finished", stopped) or ("error", message)
+    #   from it:     ("stop",), ("pause",), ("resume",),
+    #                ("extend", rows, start, positions): rows replace df from `start`
+    send_lock = threading.Lock()
+    def send(*message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, EOFError):
+                pass # GUI gone; the listener stops the run
+
+    # The GUI sends plain settings; the objects built from them live here
+    options = dict(options)
+    results_path = options.pop("results_path", "")
+    result_writer = ResultWriter(results_path, options["df"].columns) if results_path else None
+    engine = BlastEngine(
+        rate_limiter=RateLimiter(*options.pop("rate")),
+        recycle=RecyclePolicy(max_rss_mb=options.pop("recycle_rss_mb")),
+        result_writer=result_writer,
+        on_progress=lambda value, message: send("progress", value, message),
+        on_status=lambda pos, status, reason: send("status", pos, status, reason),
+        on_saving=lambda: send("saving"),
+        **options,
+    )
+
+    def listen():
+        import pandas as pd
+        while True:
+            try:
+                command, *args = conn.recv()
+            except (OSError, EOFError):
+                engine.stop() # The GUI exited or crashed
+                return
+            if command == "stop":
+                engine.stop()
+            elif command == "pause":
+                engine.pause()
+            elif command == "resume":
+                engine.resume()
+            elif command == "extend":
+                rows, start, positions = args
+                engine.extend(pd.concat([engine.df.iloc[:start], rows]), positions)
+    threading.Thread(target=listen, name="gui-pipe", daemon=True).start()
+
+    try:
+        engine.run()
+    except Exception as e:
+        send("error", str(e))
+    else:
+        send("finished", engine.control.stopped)
+    conn.close()
+
+# --- Command Line ---
+
+def positive_int(value):
+    # argparse type for counts and rates, which RateLimiter divides by or
+    # indexes with
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send a WhatsApp blast without the GUI.",
+                                     epilog="Exit status: 0 when done, 1 when stopped, 2 for bad arguments, 3 when the run failed.")
+    parser.add_argument("--sheet", required=True, help="Excel workbook with a Phone column")
+    parser.add_argument("--sheet-name", action="append", help="Sheet to send to (repeat to combine sheets; default: first sheet)")
+    parser.add_argument("--template", required=True, help="Text file with the message; {Column} inserts a sheet value")
+    parser.add_argument("--segment", default="", help='Only send to rows matching this expression, e.g. \'City == "Bandung"\'')
+    parser.add_argument("--media", help="Image to attach to every message")
+    parser.add_argument("--rate", type=positive_int, default=12, help="Messages per minute (default: 12)")
+    parser.add_argument("--hourly-cap", type=positive_int, default=200)
+    parser.add_argument("--daily-cap", type=positive_int, default=1000)
+    parser.add_argument("--max-messages", type=positive_int, default=100)
+    parser.add_argument("--profile", default="", help="Firefox profile directory with a logged-in WhatsApp Web session")
+    parser.add_argument("--clone-profile", action="store_true", help="Launch from a temporary copy of the profile's WhatsApp login (faster; works while Firefox is open)")
+    parser.add_argument("--headless", action="store_true", help="Run Firefox without a window")
+    parser.add_argument("--lean-browser", action="store_true", help="Fewer processes, no animations, telemetry or updates, eager page loads")
+    parser.add_argument("--recycle-rss", type=int, default=1500, help="Restart Firefox between rows once it uses more than this many MB (0: off)")
+    parser.add_argument("--recycle-latency", type=float, default=3.0, help="Restart Firefox once sends get this many times slower than after launch (0: off)")
+    parser.add_argument("--recycle-every", type=int, default=0, help="Also restart Firefox every N messages (0: off)")
+    parser.add_argument("--results", help="Write per-row results to this .xlsx or .csv")
+    parser.add_argument("--json", action="store_true", help="Print progress as JSON lines")
+    args = parser.parse_args(argv)
+
+    with open(args.template, "r", encoding="utf-8") as f:
+        template = f.read()
+
+    def emit(event, **fields):
+        if args.json:
+            print(json.dumps({"event": event, **fields}, default=str), flush=True)
+        elif event == "progress":
+            print(f"[{fields['value']:3d}%] {fields['message']}", flush=True)
+        elif event == "status" and fields["status"] in ("sent", "failed", "skipped"):
+            reason = f" ({fields['reason']})" if fields["reason"] else ""
+            print(f"       row {fields['row'] + 1}: {fields['status']}{reason}", flush=True)
+
+    try:
+        names = [name for name, _ in list_sheets(args.sheet)]
+    except Exception as e:
+        parser.error(f"cannot read --sheet {args.sheet}: {e}")
+    unknown = [name for name in args.sheet_name or [] if name not in names]
+    if unknown:
+        parser.error(f"no sheet named {', '.join(map(repr, unknown))} in {args.sheet} (sheets: {', '.join(names)})")
+    sheets = args.sheet_name or names[:1]
+    source = open_sheets(args.sheet, sheets, SheetCache())
+    source.ensure_columns(campaign_columns(source.columns, template, args.segment))
+    if args.results:
+        source.load_all() # The export carries the original rows
+    df = source.df
+    positions = list(range(len(df)))
+    if args.segment:
+        positions = [int(p) for p in evaluate_segment(df, args.segment).nonzero()[0]]
+    emit("loaded", rows=len(df), selected=len(positions), sheets=sheets)
+    locked_by = profile_lock_pid(args.profile) if args.profile else None
+    if locked_by and not args.clone_profile:
+        debug(f"Warning: Firefox (pid {locked_by}) is using {args.profile}; close it or the browser will fail to start.")
+
+    engine = BlastEngine(
+        df,
+        positions,
+        template,
+        args.media,
+        RateLimiter(args.rate, args.hourly_cap, args.daily_cap),
+        args.max_messages,
+        profile_path=args.profile,
+        clone_profile=args.clone_profile,
+        lean_browser=args.lean_browser,
+        recycle=RecyclePolicy(args.recycle_rss, args.recycle_latency, args.recycle_every),
+        headless=args.headless,
+        result_writer=ResultWriter(args.results, df.columns) if args.results else None,
+        quit_browser=True,
+        on_progress=lambda value, message: emit("progress", value=value, message=message),
+        on_status=lambda pos, status, reason: emit("status", row=pos, status=status, reason=reason, time=format_time(time.time())),
+    )
+    # Ctrl+C / SIGTERM stop at the next check instead of killing the browser mid-send
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: engine.control.stop())
+    try:
+        engine.run()
+    except Exception as e:
+        # e.g. Firefox or geckodriver could not be started
+        if args.json:
+            emit("error", message=str(e), done=len(engine.finished_rows))
+        else:
+            debug(f"Error: {e}")
+        return 3
+    emit("finished", stopped=engine.control.stopped, done=len(engine.finished_rows))
+    return 1 if engine.control.stopped else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
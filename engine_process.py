@@ -0,0 +1,30 @@
+import sys
+import types
+import multiprocessing
+
+# Starts engine.serve in its own process for the GUI (SenderWorker in
+# main.py). Only the standard library is imported here, so neither the GUI
+# nor the engine process pays for what the other one needs: selenium and
+# the engine load in the child only, PyQt6 in the parent only.
+
+def serve(conn, options):
+    # Runs in the child; named by this module, so unpickling it there
+    # imports nothing but this file
+    from engine import serve
+    serve(conn, options)
+
+def spawn(conn, options):
+    # "spawn" because a forked copy of a running Qt app is not safe to use.
+    # A spawned child re-runs the parent's __main__ script first, so objects
+    # defined there can be unpickled; for main.py that would mean PyQt6, the
+    # whole window module and numpy. Nothing sent to the engine comes from
+    # __main__, so a blank one stands in while the child is prepared.
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(target=serve, args=(conn, options), name="blast-engine", daemon=True)
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        process.start()
+    finally:
+        sys.modules["__main__"] = main_module
+    return process
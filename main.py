@@ -1,316 +1,452 @@
 
 import sys
 import time
-import urllib.parse
 import os
-import pandas as pd
+import builtins
+import multiprocessing
+import threading
+
+# --- Startup Timing ---
+
+class StartupReport:
+    # `python main.py --startup-report` prints to stderr how long each startup
+    # phase took, plus every top-level import as it finishes (cumulative,
+    # like `python -X importtime`). Imports deferred until first use are
+    # timed on whichever thread makes them, so pandas shows up as `sheets`
+    # when the first workbook loads. selenium is never listed: it only loads
+    # in the engine process (engine_process.py).
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.began = time.perf_counter()
+        self._local = threading.local() # Import depth per thread
+        if enabled:
+            self._import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, *args, **kwargs):
+        depth = getattr(self._local, "depth", 0)
+        if name in sys.modules or depth:
+            return self._import(name, *args, **kwargs)
+        self._local.depth = 1
+        start = time.perf_counter()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            self._local.depth = 0
+            print(f"[startup] import {name:<28} {(time.perf_counter() - start) * 1000:8.1f} ms", file=sys.stderr)
+
+    def mark(self, phase):
+        if self.enabled:
+            print(f"[startup] {phase:<35} {time.perf_counter() - self.began:8.3f} s", file=sys.stderr)
+
+STARTUP = StartupReport("--startup-report" in sys.argv)
+
+import numpy as np
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QLabel, QPushButton, QFileDialog, QTableView, QTextEdit, 
                              QLineEdit, QSpinBox, QProgressBar, QMessageBox, QDialog, 
-                             QFormLayout, QGroupBox, QSplitter, QComboBox, QCheckBox)
-from PyQt6.QtCore import Qt, QAbstractTableModel, QThread, pyqtSignal
-from PyQt6.QtGui import QAction, QIcon, QFont
-
-from selenium import webdriver
-from selenium.webdriver.firefox.service import Service
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.firefox import GeckoDriverManager
+                             QFormLayout, QGroupBox, QSplitter, QComboBox, QCheckBox,
+                             QInputDialog, QListWidget, QListWidgetItem)
+from PyQt6.QtCore import Qt, QAbstractTableModel, QByteArray, QThread, QTimer, QFileSystemWatcher, pyqtSignal
+from PyQt6.QtGui import QAction, QIcon, QFont, QColor
+
+from config import load_segments, save_segments, load_settings, save_settings
+from profiles import find_profile_roots, profile_lock_pid, scan_profiles
+from engine_process import spawn
+
+# pandas (sheets.py) is imported on first use so the window opens without
+# waiting for it; selenium (engine.py) only loads in the engine process
 
 # --- Models ---
 
 class PandasModel(QAbstractTableModel):
+    # Column 0 is a per-row send status; the sheet's own columns follow.
+    # Statuses live in flat NumPy arrays indexed by the row's position in the
+    # DataFrame, and `_rows` maps table rows to those positions so the view
+    # can be filtered and sorted without copying the DataFrame. Filters are
+    # evaluated as vectorized boolean masks rather than per-row data() calls.
+    STATUSES = ["pending", "sending", "sent", "failed", "skipped"]
+    STATUS_COLORS = {
+        "sending": QColor("#fff3cd"),
+        "sent": QColor("#d4edda"),
+        "failed": QColor("#f8d7da"),
+        "skipped": QColor("#e2e3e5"),
+    }
+
     def __init__(self, data):
         super(PandasModel, self).__init__()
         self._data = data
+        n = len(data)
+        self._status = np.zeros(n, dtype=np.int8)
+        self._status_time = np.zeros(n, dtype=np.float64)
+        self._reasons = {} # position -> reason, only for rows that have one
+        self._status_filter = None
+        self._search_query = ""
+        self._search_mask = None
+        self._segment_mask = None
+        self._sort_key = None # (column, descending) or None for sheet order
+        self._argsort_cache = {} # sheet column -> ascending permutation
+        self._search_cache = {} # sheet column -> lower-cased string Series
+        self._set_rows(np.arange(n))
+
+    def _set_rows(self, rows):
+        self._rows = rows
+        # Inverse mapping so a status update can find its table row in O(1)
+        self._view_row = np.full(len(self._data), -1, dtype=np.int64)
+        self._view_row[rows] = np.arange(len(rows))
 
     def rowCount(self, parent=None):
-        return self._data.shape[0]
+        return len(self._rows)
 
     def columnCount(self, parent=None):
-        return self._data.shape[1]
+        return self._data.shape[1] + 1
 
     def data(self, index, role=Qt.ItemDataRole.DisplayRole):
-        if index.isValid():
+        if not index.isValid():
+            return None
+        pos = self._rows[index.row()]
+        col = index.column()
+        if col == 0:
+            status = self.STATUSES[self._status[pos]]
             if role == Qt.ItemDataRole.DisplayRole:
-                return str(self._data.iloc[index.row(), index.column()])
+                return self._status_text(pos, status)
+            if role == Qt.ItemDataRole.ToolTipRole:
+                return self._reasons.get(pos)
+            if role == Qt.ItemDataRole.BackgroundRole:
+                return self.STATUS_COLORS.get(status)
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            return str(self._data.iloc[pos, col - 1])
         return None
 
+    def _status_text(self, pos, status):
+        if not self._status_time[pos]:
+            return status
+        text = f"{status} {time.strftime('%H:%M:%S', time.localtime(self._status_time[pos]))}"
+        reason = self._reasons.get(pos)
+        if reason:
+            text += f" - {reason}"
+        return text
+
     def headerData(self, col, orientation, role):
         if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
-            return self._data.columns[col]
+            if col == 0:
+                return "Status"
+            return self._data.columns[col - 1]
         return None
 
+    def set_status(self, pos, status, reason=""):
+        self._status[pos] = self.STATUSES.index(status)
+        self._status_time[pos] = time.time()
+        if reason:
+            self._reasons[pos] = reason
+        else:
+            self._reasons.pop(pos, None)
+        # Only repaint the one cell; rows that stop matching an active filter
+        # stay visible until the filter is re-applied.
+        row = self._view_row[pos]
+        if row >= 0:
+            cell = self.index(int(row), 0)
+            self.dataChanged.emit(cell, cell)
+
+    def set_frame(self, data):
+        # Swaps in a DataFrame with the same rows but more columns (see
+        # SheetSource), keeping statuses and the current filters.
+        self.beginResetModel()
+        self._data = data
+        self._argsort_cache = {}
+        self._search_cache = {}
+        if self._sort_key is not None and self._sort_key[0] > data.shape[1]:
+            self._sort_key = None
+        self.endResetModel()
+
+    def extend_frame(self, data):
+        # Swaps in a DataFrame with the current rows followed by new ones
+        # (see sheet watching). New rows start as pending; the segment mask
+        # is cleared and has to be re-applied for the longer frame.
+        extra = len(data) - len(self._data)
+        self._data = data
+        self._status = np.concatenate([self._status, np.zeros(extra, dtype=np.int8)])
+        self._status_time = np.concatenate([self._status_time, np.zeros(extra, dtype=np.float64)])
+        self._argsort_cache = {}
+        self._search_cache = {}
+        self._segment_mask = None
+        self.set_search(self._search_query)
+
+    def is_visible(self, positions):
+        # Boolean array: which of `positions` pass the current filters
+        return self._view_row[positions] >= 0
+
+    def set_status_filter(self, status):
+        # status is one of STATUSES, or None to show every row
+        self._status_filter = status
+        self._refresh_rows()
+
+    def set_search(self, query):
+        # Whitespace separated terms, all of which must match. A bare term
+        # matches any column; `Column:term` restricts it to one column.
+        # Matching (column names included) is a case-insensitive substring test.
+        by_name = {str(col).lower(): col for col in self._data.columns}
+        mask = None
+        for term in query.split():
+            column, sep, needle = term.partition(":")
+            if sep and column.lower() in by_name:
+                columns = [by_name[column.lower()]]
+            else:
+                columns, needle = list(self._data.columns), term
+            needle = needle.lower()
+            term_mask = np.zeros(len(self._data), dtype=bool)
+            for col in columns:
+                term_mask |= self._search_column(col).str.contains(needle, regex=False).to_numpy(dtype=bool)
+            mask = term_mask if mask is None else mask & term_mask
+        self._search_query = query
+        self._search_mask = mask
+        self._refresh_rows()
+
+    def set_segment_mask(self, mask):
+        # Boolean array over all rows (see evaluate_segment), or None
+        self._segment_mask = mask
+        self._refresh_rows()
+
+    def _search_column(self, col):
+        if col not in self._search_cache:
+            self._search_cache[col] = self._data[col].astype(str).str.lower()
+        return self._search_cache[col]
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        if column < 0:
+            self._sort_key = None # Sort indicator cleared: back to sheet order
+        else:
+            self._sort_key = (column, order == Qt.SortOrder.DescendingOrder)
+        self._refresh_rows()
+
+    def _sort_permutation(self):
+        if self._sort_key is None:
+            return np.arange(len(self._data))
+        column, descending = self._sort_key
+        if column == 0:
+            # Statuses change during a run, so this one is never cached
+            perm = np.argsort(self._status, kind="stable")
+        else:
+            perm = self._argsort_cache.get(column - 1)
+            if perm is None:
+                series = self._data.iloc[:, column - 1].reset_index(drop=True)
+                try:
+                    perm = series.sort_values(kind="stable").index.to_numpy()
+                except TypeError:
+                    # Mixed types in an object column: fall back to text order
+                    perm = series.astype(str).sort_values(kind="stable").index.to_numpy()
+                self._argsort_cache[column - 1] = perm
+        return perm[::-1] if descending else perm
+
+    def _refresh_rows(self):
+        mask = np.ones(len(self._data), dtype=bool)
+        if self._status_filter is not None:
+            mask &= self._status == self.STATUSES.index(self._status_filter)
+        if self._search_mask is not None:
+            mask &= self._search_mask
+        if self._segment_mask is not None:
+            mask &= self._segment_mask
+        perm = self._sort_permutation()
+        self.beginResetModel()
+        self._set_rows(perm[mask[perm]])
+        self.endResetModel()
+
+    def visible_positions(self):
+        # Row positions currently shown, in display order
+        return self._rows.copy()
 # --- Worker Thread for Automation ---
 
 class SenderWorker(QThread):
+    # Runs a BlastEngine in its own process (engine.serve) and relays its
+    # pipe messages as Qt signals. The engine, pandas and Selenium never
+    # share the GUI's interpreter, so sends don't stall the window and a
+    # crashed engine is reported through `error` instead of taking the app
+    # down; a new SenderWorker starts a fresh process.
     progress = pyqtSignal(int, str) # progress value, log message
+    row_status = pyqtSignal(int, str, str) # row position, status, reason
     finished = pyqtSignal()
     error = pyqtSignal(str)
+    SAVE_TIMEOUT_MS = 120000 # Longest wait for the results file on window close
 
-    def __init__(self, df, message_template, image_path, delay, max_messages, user_data_dir, profile_dir):
+    # rate is (per minute, hourly cap, daily cap); the engine process builds
+    # its RateLimiter and RecyclePolicy from these plain settings, so the
+    # GUI never imports engine.py (and Selenium) itself.
+    def __init__(self, df, positions, message_template, image_path, rate, max_messages, user_data_dir, profile_dir, results_path="", clone_profile=False, lean_browser=False, recycle_rss_mb=1500):
         super().__init__()
-        self.df = df
-        self.message_template = message_template
-        self.image_path = image_path
-        self.delay = delay
-        self.max_messages = max_messages
-        self.user_data_dir = user_data_dir
-        self.profile_dir = profile_dir # In Firefox logic, we just combine these or use the full path
-        self.is_running = True
+        # In Firefox logic, we just combine these into the full profile path
+        profile_path = os.path.join(user_data_dir, profile_dir) if user_data_dir and profile_dir else ""
+        self.options = dict(
+            df=df, positions=list(positions), message_template=message_template, image_path=image_path,
+            rate=tuple(rate), max_messages=max_messages, profile_path=profile_path,
+            clone_profile=clone_profile, lean_browser=lean_browser, recycle_rss_mb=recycle_rss_mb,
+            results_path=results_path,
+        )
+        self.rows, self.columns = len(df), list(df.columns) # What the engine's df holds
+        self.conn = None
+        self.process = None
+        self.stopped = False
+        self.saving = False # Engine is past sending and writing the results file
 
     def run(self):
-        driver = None
+        self.conn, child_conn = multiprocessing.Pipe()
         try:
-            self.progress.emit(0, "Initializing Firefox Driver...")
-            
-            options = Options()
-            
-            # Handle Profile
-            # If user selected a specific profile folder, we use it.
-            # user_data_dir is usually ~/.mozilla/firefox
-            # profile_dir is the specific folder (e.g. xxxxx.default)
-            if self.user_data_dir and self.profile_dir:
-                full_profile_path = os.path.join(self.user_data_dir, self.profile_dir)
-                if os.path.exists(full_profile_path):
-                    self.progress.emit(2, f"Using profile: {self.profile_dir}")
-                    options.add_argument("-profile")
-                    options.add_argument(full_profile_path)
-            
-            service = Service(GeckoDriverManager().install())
-            driver = webdriver.Firefox(service=service, options=options)
-            
-            self.progress.emit(5, "Opening WhatsApp Web...")
-            driver.get("https://web.whatsapp.com")
-            
-            self.progress.emit(10, "Please scan QR code if not logged in. Waiting for 30s...")
-            try:
-                # Wait for main element to ensure login
-                WebDriverWait(driver, 60).until(
-                    EC.presence_of_element_located((By.XPATH, '//div[@contenteditable="true"][@data-tab="3"]'))
-                )
-                self.progress.emit(15, "Logged in successfully!")
-            except:
-                self.progress.emit(15, "Login wait timed out. Attempting to proceed (Manual check needed if QR still there).")
-
-            total_messages = min(len(self.df), self.max_messages)
-            
-            for index, row in self.df.iterrows():
-                if not self.is_running:
-                    break
-                
-                if index >= self.max_messages:
-                    self.progress.emit(100, f"Reached limit of {self.max_messages} messages.")
-                    break
-
-                phone = str(row.get('Phone', '')).strip()
-                if not phone:
-                    self.progress.emit(int((index/total_messages)*100), f"Skipping row {index+1}: No Phone number")
-                    continue
-                
-                # Format message
-                try:
-                    # Simple template replacement
-                    msg = self.message_template
-                    for col in self.df.columns:
-                        val = str(row[col])
-                        msg = msg.replace(f"{{{col}}}", val)
-                except Exception as e:
-                    self.progress.emit(int((index/total_messages)*100), f"Error formatting message for {phone}: {e}")
-                    continue
-
-                self.progress.emit(int((index/total_messages)*100), f"Sending to {phone}...")
-                
-                try:
-                    # 1. Open Chat
-                    encoded_msg = urllib.parse.quote(msg)
-                    link = f"https://web.whatsapp.com/send?phone={phone}&text={encoded_msg}"
-                    driver.get(link)
-                    
-                    # Wait for chat to load (input box available)
-                    input_box_xpath = '//div[@contenteditable="true"][@data-tab="10"]'
-                    try:
-                        WebDriverWait(driver, 20).until(
-                            EC.presence_of_element_located((By.XPATH, input_box_xpath))
-                        )
-                    except:
-                        self.progress.emit(int((index/total_messages)*100), f"Failed to load chat for {phone}. Number might be invalid.")
-                        continue
-
-                    # 2. Attach Image if exists
-                    if self.image_path and os.path.exists(self.image_path):
-                        try:
-                            # Click attach button (New: Plus icon, Old: Clip icon)
-                            attach_xpath = '//span[@data-icon="plus-rounded"] | //div[@title="Attach"] | //span[@data-icon="clip"]'
-                            attach_btn = WebDriverWait(driver, 15).until(
-                                EC.presence_of_element_located((By.XPATH, attach_xpath))
-                            )
-                            # Wait a bit for UI to settle (to avoid menu closing immediately if still loading)
-                            time.sleep(1)
-                            
-                            # Use JavaScript Click for Attach button to avoid interception
-                            driver.execute_script("arguments[0].click();", attach_btn)
-                            
-                            time.sleep(2) # Wait for menu animation
-                            
-                            # Explicitly CLICK "Photos & Videos" button
-                            print("Clicking 'Photos & Videos' button...")
-                            try:
-                                # Updated Robust XPaths based on HTML analysis
-                                photo_video_xpath = (
-                                    '//*[contains(text(), "Foto & Video")] | '         
-                                    '//*[contains(text(), "Photos & Videos")] | '
-                                    '//*[local-name()="svg"]/*[local-name()="title"][text()="ic-filter-filled"]/ancestor::div[@role="button"] | '
-                                    '//*[local-name()="svg"]/*[local-name()="title"][text()="ic-filter-filled"]/ancestor::li'
-                                )
-                                
-                                # Wait for elements
-                                buttons = WebDriverWait(driver, 5).until(
-                                    EC.presence_of_all_elements_located((By.XPATH, photo_video_xpath))
-                                )
-                                
-                                target_btn = None
-                                for btn in buttons:
-                                    # Safety Check: ensure we don't click Sticker
-                                    # Get outer HTML to check for "Sticker" keyword nearby
-                                    try:
-                                        # Go up a few levels to check context
-                                        context_html = btn.find_element(By.XPATH, "./../..").get_attribute('outerHTML')
-                                        if "Stiker" in context_html or "Sticker" in context_html or "wds-ic-sticker" in context_html:
-                                            continue
-                                    except:
-                                        pass
-                                        
-                                    target_btn = btn
-                                    break
-                                
-                                if target_btn:
-                                    print("Found Photo/Video button via text/icon match.")
-                                    driver.execute_script("arguments[0].click();", target_btn)
-                                else:
-                                    # Fallback: Just click the 2nd item in the list (index 1) if strictly safe
-                                    print("Text/Icon match suspect. Trying fallback to 2nd list item...")
-                                    fallback_xpath = '//ul/li[2]//div[@role="button"]'
-                                    fallback_btn = driver.find_element(By.XPATH, fallback_xpath)
-                                    driver.execute_script("arguments[0].click();", fallback_btn)
-
-                                time.sleep(2) # Wait for input spawn
-                                
-                            except Exception as e:
-                                print(f"Failed to click Photo/Video button: {e}")
-                                # DEBUG: Dump the menu HTML to see what's wrong
-                                try:
-                                    menu = driver.find_element(By.XPATH, '//ul')
-                                    print("--- DUMPING MENU HTML FOR DEBUGGING ---")
-                                    print(menu.get_attribute('outerHTML')[:500]) # Print first 500 chars
-                                    print("--- END DUMP ---")
-                                except:
-                                    print("Could not dump menu HTML.")
-                                # raise e # Do not raise, let it try to find input anyway
-
-                            # Find the file input that accepts VIDEO (identifies Photo/Video input)
-                            inputs = driver.find_elements(By.XPATH, '//input[@type="file"]')
-                            target_input = None
-                            
-                            for inp in inputs:
-                                accept = inp.get_attribute('accept')
-                                if accept and 'video' in accept:
-                                    target_input = inp
-                                    break
-                            
-                            # Fallback: Just take the last input spawned
-                            if not target_input and inputs:
-                                target_input = inputs[-1]
-                            
-                            if target_input:
-                                target_input.send_keys(self.image_path)
-                            else:
-                                raise Exception("No file input found after clicking Photos & Videos.")
-                            
-                            # Wait for preview and send button (Image/Doc)
-                            
-                            # Wait for preview and send button (Image/Doc)
-                            # CRITICAL: Wait for the image/doc to actually load in the preview modal
-                            
-                            # Multiple selectors for the Send button in the preview modal
-                            # 1. Standard icon spans
-                            # 2. The green circle button wrapper (usually has aria-label="Send" or "Kirim")
-                            # 3. The specific class provided by user (risky if dynamic, but added as fallback)
-                            
-                            send_xpath = (
-                                '//span[@data-icon="send"] | '
-                                '//span[@data-icon="wds-ic-send-filled"] | '
-                                '//span[@data-icon="send-light"] | '
-                                '//div[@aria-label="Send"] | '
-                                '//div[@aria-label="Kirim"] | '
-                                '//div[contains(@class, "x1ey2m1c") and @role="button"]' # Adjusted to look for button role
-                            )
-                            
-                            # Increased wait time and specific condition
-                            send_btn_img = WebDriverWait(driver, 15).until(
-                                EC.presence_of_element_located((By.XPATH, send_xpath))
-                            )
-                            
-                            # Force wait for animation/overlay to clear
-                            time.sleep(2) 
-                            
-                            # Use JavaScript Click for Image Send
-                            driver.execute_script("arguments[0].click();", send_btn_img)
-                            
-                            # Wait for upload and return to chat
-                            time.sleep(3)
-                            
-                        except Exception as e:
-                             self.progress.emit(int((index/total_messages)*100), f"Error sending image to {phone}: {e}")
-                    
-                    # 3. Send Text Message
-                    # The text is likely still in the input box from the initial URL load.
-                    # We try to find the send button again (now in main chat view) and click it.
-                    try:
-                        self.progress.emit(int((index/total_messages)*100), f"Sending text to {phone}...")
-                        
-                        send_xpath = '//span[@data-icon="send"] | //span[@data-icon="wds-ic-send-filled"] | //span[@data-icon="send-light"] | //button[@aria-label="Send"]'
-                        # Reduced timeout as button should be there if text is present
-                        send_btn = WebDriverWait(driver, 5).until(
-                                EC.element_to_be_clickable((By.XPATH, send_xpath))
-                        )
-                        driver.execute_script("arguments[0].click();", send_btn)
-                    except:
-                        # Fallback: Press Enter on the active element (the input box)
-                        # self.progress.emit(int((index/total_messages)*100), f"Click failed, trying ENTER key for {phone}...")
-                        try:
-                             driver.switch_to.active_element.send_keys(Keys.ENTER)
-                        except Exception as ex:
-                             self.progress.emit(int((index/total_messages)*100), f"Failed to send text to {phone}: {ex}")
-                    
-                    self.progress.emit(int(((index+1)/total_messages)*100), f"Sent to {phone}")
-                    
-                    time.sleep(self.delay)
-
-                except Exception as e:
-                    self.progress.emit(int((index/total_messages)*100), f"Failed to send to {phone}: {e}")
-
-            self.progress.emit(100, "Automation Complete!")
-            
+            self.process = spawn(child_conn, self.options)
         except Exception as e:
-            self.error.emit(str(e))
+            self.error.emit(f"Could not start the engine process: {e}")
+            return
         finally:
-            if driver:
-                time.sleep(5)
-                # driver.quit() # Uncomment to auto-close
+            child_conn.close() # Only the child holds it now, so its exit ends recv()
+            self.options = None
+        while True:
+            try:
+                kind, *args = self.conn.recv()
+            except (EOFError, OSError):
+                self.process.join()
+                self.error.emit(f"Engine process exited unexpectedly (exit code {self.process.exitcode}). Press Send to start it again.")
+                return
+            if kind == "progress":
+                self.progress.emit(*args)
+            elif kind == "status":
+                self.row_status.emit(*args)
+            elif kind == "saving":
+                self.saving = True
+            elif kind == "finished":
+                self.stopped = args[0]
+                self.process.join()
                 self.finished.emit()
+                return
+            elif kind == "error":
+                self.process.join()
+                self.error.emit(args[0])
+                return
+
+    def send(self, *message):
+        if self.conn is None:
+            return
+        try:
+            self.conn.send(message)
+        except (OSError, ValueError):
+            pass # Engine already gone; run() reports it
+
+    def extend(self, df, positions):
+        # Only the appended rows cross the pipe while the columns stay the same
+        start = self.rows if list(df.columns) == self.columns and len(df) >= self.rows else 0
+        self.send("extend", df.iloc[start:], start, list(positions))
+        self.rows, self.columns = len(df), list(df.columns)
 
     def stop(self):
-        self.is_running = False
+        self.stopped = True
+        self.send("stop")
+
+    def pause(self):
+        self.send("pause")
+
+    def resume(self):
+        self.send("resume")
+
+    def kill(self):
+        # Ends the engine without waiting for it, e.g. when the window closes
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+
+# --- Background Sheet Loading ---
+
+class SheetLoadWorker(QThread):
+    # With list_workbook, the workbook's sheets are listed first (`listed`)
+    # and `sheets` falls back to the first sheet when empty or no longer
+    # present. cache may be None; one is created here so pandas is imported
+    # off the GUI thread. With `source`, nothing is opened: `columns` are
+    # loaded into that already open source (see MainWindow.load_columns).
+    listed = pyqtSignal(object) # [(sheet name, row count)]
+    loaded = pyqtSignal(object, float) # source, seconds taken
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, sheets, cache, template, expression, all_columns, list_workbook=False, source=None, columns=()):
+        super().__init__()
+        self.source = source
+        self.columns = set(columns)
+        self.path = path
+        self.sheets = sheets
+        self.cache = cache
+        self.template = template
+        self.expression = expression
+        self.all_columns = all_columns
+        self.list_workbook = list_workbook
+
+    def run(self):
+        from sheets import SheetCache, campaign_columns, list_sheets, open_sheets
+        try:
+            start = time.perf_counter()
+            if self.source is not None:
+                self.source.ensure_columns(self.columns)
+                self.loaded.emit(self.source, time.perf_counter() - start)
+                return
+            if self.cache is None:
+                self.cache = SheetCache()
+            if self.list_workbook:
+                available = list_sheets(self.path)
+                names = [name for name, _ in available]
+                self.sheets = [name for name in self.sheets or [] if name in names] or names[:1]
+                self.listed.emit(available)
+            source = open_sheets(self.path, self.sheets, self.cache)
+            if self.all_columns:
+                source.load_all()
+            else:
+                source.ensure_columns(campaign_columns(source.columns, self.template, self.expression))
+            self.loaded.emit(source, time.perf_counter() - start)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class SheetWatchWorker(QThread):
+    # Re-reads a changed workbook and finds the rows not loaded yet
+    diffed = pyqtSignal(object, float) # DataFrame of new rows, seconds taken
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, sheets, cache, old_df):
+        super().__init__()
+        self.path = path
+        self.sheets = sheets
+        self.cache = cache
+        self.old_df = old_df
+
+    def run(self):
+        from sheets import find_new_rows, open_sheets
+        try:
+            start = time.perf_counter()
+            source = open_sheets(self.path, self.sheets, self.cache)
+            source.load_all()
+            new = source.df.iloc[find_new_rows(self.old_df, source.df)]
+            self.diffed.emit(new, time.perf_counter() - start)
+        except Exception as e:
+            self.failed.emit(str(e))
 
 # --- Dialogs ---
 
+class ProfileScanWorker(QThread):
+    # Reads profiles.ini for one folder off the GUI thread (see profiles.py)
+    scanned = pyqtSignal(str, object, str) # root, [(FirefoxProfile, pid locking it or None)], error
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = root
+
+    def run(self):
+        try:
+            profiles = scan_profiles(self.root)
+            # Lock status is read here too, not on the GUI thread
+            self.scanned.emit(self.root, [(profile, profile.locked_pid) for profile in profiles], "")
+        except Exception as e:
+            self.scanned.emit(self.root, [], str(e))
+
 class EnvDialog(QDialog):
-    def __init__(self, parent=None):
+    # `env` holds the last choice as returned by get_data; an empty
+    # user_data_dir and profile_dir mean the temporary session was used
+    def __init__(self, parent=None, env=None):
         super().__init__(parent)
+        env = env or {}
+        user_data_dir = env.get("user_data_dir")
+        profile_dir = env.get("profile_dir")
         self.setWindowTitle("Environment Setup (Firefox)")
         self.resize(500, 200)
         self.setModal(True)
@@ -321,22 +457,50 @@ class EnvDialog(QDialog):
         self.temp_session_cb.toggled.connect(self.toggle_inputs)
         self.layout.addRow(self.temp_session_cb)
         
-        self.firefox_path_input = QLineEdit()
-        # Default Linux Firefox Path (Check Snap first, then standard)
-        snap_path = os.path.join(os.path.expanduser("~"), "snap", "firefox", "common", ".mozilla", "firefox")
-        std_path = os.path.join(os.path.expanduser("~"), ".mozilla", "firefox")
+        # Profile folders found on this machine (Snap first, then Flatpak,
+        # then standard); the field stays editable for anything else
+        self.firefox_path_input = QComboBox()
+        self.firefox_path_input.setEditable(True)
+        for label, path in find_profile_roots():
+            self.firefox_path_input.addItem(path)
+            self.firefox_path_input.setItemData(self.firefox_path_input.count() - 1, label, Qt.ItemDataRole.ToolTipRole)
+        if user_data_dir:
+            self.firefox_path_input.setEditText(user_data_dir)
+        elif self.firefox_path_input.count() == 0:
+            self.firefox_path_input.setEditText(os.path.join(os.path.expanduser("~"), ".mozilla", "firefox"))
         
-        if os.path.exists(snap_path):
-            self.firefox_path_input.setText(snap_path)
-        else:
-            self.firefox_path_input.setText(std_path)
-            
-        self.firefox_path_input.textChanged.connect(self.scan_profiles)
+        # Scan once typing pauses rather than on every keystroke
+        self.scan_timer = QTimer(self)
+        self.scan_timer.setSingleShot(True)
+        self.scan_timer.setInterval(300)
+        self.scan_timer.timeout.connect(self.scan_profiles)
+        self.firefox_path_input.editTextChanged.connect(self.scan_timer.start)
+        self.scanners = []
+        self.wanted_profile = profile_dir
         
         self.profile_combo = QComboBox()
+        self.profile_combo.currentIndexChanged.connect(self.update_lock_warning)
+        self.lock_label = QLabel("")
+        self.lock_label.setStyleSheet("color: #c0392b;")
+        self.lock_label.setWordWrap(True)
+        self.lock_label.hide()
         
         self.layout.addRow("Firefox Profiles Path:", self.firefox_path_input)
         self.layout.addRow("Select Profile:", self.profile_combo)
+        self.layout.addRow(self.lock_label)
+        
+        self.clone_cb = QCheckBox("Launch from a temporary copy of the login data")
+        self.clone_cb.setToolTip("Copies only the WhatsApp Web login (cookies and site storage) to a temporary profile. "
+                                 "Starts faster, works while Firefox is open, and syncs the login back when done.")
+        self.clone_cb.setChecked(env.get("clone_profile", False))
+        self.clone_cb.toggled.connect(self.update_lock_warning)
+        self.layout.addRow(self.clone_cb)
+        
+        self.lean_cb = QCheckBox("Lean browser (one content process, no animations, telemetry or updates)")
+        self.lean_cb.setToolTip("Uses automation-friendly Firefox preferences and an eager page load strategy to cut memory and CPU use. "
+                                "Memory and time per message are logged after each run for comparison.")
+        self.lean_cb.setChecked(env.get("lean_browser", False))
+        self.layout.addRow(self.lean_cb)
         
         self.btn_box = QHBoxLayout()
         self.ok_btn = QPushButton("OK")
@@ -347,37 +511,65 @@ class EnvDialog(QDialog):
         
         # Initial scan
         self.scan_profiles()
+        if user_data_dir == "" and profile_dir == "":
+            self.temp_session_cb.setChecked(True)
         
     def toggle_inputs(self, checked):
         self.firefox_path_input.setEnabled(not checked)
         self.profile_combo.setEnabled(not checked)
+        self.clone_cb.setEnabled(not checked)
+        self.update_lock_warning()
         
     def scan_profiles(self):
-        path = self.firefox_path_input.text()
+        self.scan_timer.stop()
         self.profile_combo.clear()
-        
-        if os.path.exists(path) and os.path.isdir(path):
-            profiles = []
-            try:
-                for entry in os.listdir(path):
-                    # Firefox profiles usually end in .default or .default-release or contain alphanumeric salt
-                    full_entry = os.path.join(path, entry)
-                    if os.path.isdir(full_entry) and (entry.endswith(".default") or entry.endswith(".default-release") or "." in entry):
-                         profiles.append(entry)
-            except Exception:
-                pass
-            
-            if not profiles:
-                 self.profile_combo.addItem("No profiles found")
-            else:
-                 self.profile_combo.addItems(sorted(profiles))
-        else:
+        self.profile_combo.addItem("Scanning...")
+        scanner = ProfileScanWorker(self.firefox_path_input.currentText())
+        scanner.scanned.connect(self.profiles_scanned)
+        self.scanners.append(scanner)
+        scanner.start()
+
+    def profiles_scanned(self, root, profiles, error):
+        if root != self.firefox_path_input.currentText():
+            return # The path changed while scanning; a newer scan is on its way
+        wanted = self.wanted_profile or (self.profile_combo.currentData() if self.profile_combo.count() else None)
+        self.profile_combo.clear()
+        if error:
             self.profile_combo.addItem("Invalid Path")
+        elif not profiles:
+            self.profile_combo.addItem("No profiles found")
+        for profile, pid in profiles:
+            label = profile.name + (" (default)" if profile.is_default else "")
+            if pid:
+                label += " - in use"
+            self.profile_combo.addItem(label, profile.path)
+            self.profile_combo.setItemData(self.profile_combo.count() - 1, pid, Qt.ItemDataRole.UserRole + 1)
+        if wanted:
+            self.profile_combo.setCurrentIndex(max(self.profile_combo.findData(wanted), 0))
+            self.wanted_profile = None
+        self.update_lock_warning()
+
+    def update_lock_warning(self, *_):
+        pid = self.profile_combo.currentData(Qt.ItemDataRole.UserRole + 1)
+        if pid and not self.temp_session_cb.isChecked() and not self.clone_cb.isChecked():
+            self.lock_label.setText(f"Firefox (pid {pid}) is using this profile. Close Firefox before starting a blast, or launch from a temporary copy.")
+            self.lock_label.show()
+        else:
+            self.lock_label.hide()
+
+    def done(self, result):
+        for scanner in self.scanners:
+            scanner.wait() # Scans take milliseconds; don't destroy a running thread
+        super().done(result)
             
     def get_data(self):
-        if self.temp_session_cb.isChecked():
-            return "", ""
-        return self.firefox_path_input.text(), self.profile_combo.currentText()
+        temp_session = self.temp_session_cb.isChecked()
+        return {
+            "user_data_dir": "" if temp_session else self.firefox_path_input.currentText(),
+            "profile_dir": "" if temp_session else self.profile_combo.currentData() or "",
+            "clone_profile": not temp_session and self.clone_cb.isChecked(),
+            "lean_browser": self.lean_cb.isChecked(),
+        }
 
 # --- Main Window ---
 
@@ -389,7 +581,15 @@ class MainWindow(QMainWindow):
         
         self.user_data_dir = ""
         self.profile_dir = ""
+        self.workbook_path = None
+        self.loaded_sheets = []
+        self.source = None
+        self.column_loader = None # SheetLoadWorker adding columns to source
+        self.pending_columns = set()
+        self.pending_blast = None # (message, clone_profile) of a Send waiting for columns
+        self.sheet_cache = None # Created by the first SheetLoadWorker
         self.df = None
+        self.model = None
         self.image_path = None
         
         # Central Widget
@@ -412,26 +612,105 @@ class MainWindow(QMainWindow):
         self.upload_btn = QPushButton("Upload Excel")
         self.upload_btn.clicked.connect(self.upload_excel)
         self.file_label = QLabel("No file selected")
+        self.sheet_list = QListWidget()
+        self.sheet_list.setMaximumHeight(100)
+        self.sheet_list.setToolTip("Tick several sheets to combine them into one campaign")
+        self.load_sheets_btn = QPushButton("Load Selected Sheets")
+        self.load_sheets_btn.clicked.connect(self.load_selected_sheets)
+        self.sheet_list.hide()
+        self.load_sheets_btn.hide()
         upload_layout.addWidget(self.upload_btn)
         upload_layout.addWidget(self.file_label)
+        upload_layout.addWidget(self.sheet_list)
+        upload_layout.addWidget(self.load_sheets_btn)
+        self.watch_cb = QCheckBox("Watch file for new rows")
+        self.watch_cb.setToolTip("Rows added to the workbook while a campaign runs are appended to it")
+        self.watch_cb.toggled.connect(self.toggle_watch)
+        upload_layout.addWidget(self.watch_cb)
+        self.file_watcher = QFileSystemWatcher(self)
+        self.file_watcher.fileChanged.connect(self.watched_file_changed)
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.setInterval(1000) # Let the writer finish saving
+        self.watch_timer.timeout.connect(self.check_for_new_rows)
+        self.sheet_watcher = None
         upload_box.setLayout(upload_layout)
         left_layout.addWidget(upload_box)
         
+        # 2b. Audience Segment
+        segment_box = QGroupBox("Audience Segment")
+        segment_layout = QVBoxLayout()
+        segment_row = QHBoxLayout()
+        self.segment_combo = QComboBox()
+        self.segment_combo.activated.connect(self.select_segment)
+        save_segment_btn = QPushButton("Save")
+        save_segment_btn.clicked.connect(self.save_segment)
+        delete_segment_btn = QPushButton("Delete")
+        delete_segment_btn.clicked.connect(self.delete_segment)
+        segment_row.addWidget(self.segment_combo, 1)
+        segment_row.addWidget(save_segment_btn)
+        segment_row.addWidget(delete_segment_btn)
+        self.segment_input = QLineEdit()
+        self.segment_input.setPlaceholderText('e.g. City == "Bandung" and LastPurchase > "2026-01-01"')
+        self.segment_timer = QTimer(self)
+        self.segment_timer.setSingleShot(True)
+        self.segment_timer.setInterval(250)
+        self.segment_timer.timeout.connect(self.apply_segment)
+        self.segment_input.textChanged.connect(self.segment_timer.start)
+        self.segment_label = QLabel("All rows")
+        segment_layout.addLayout(segment_row)
+        segment_layout.addWidget(self.segment_input)
+        segment_layout.addWidget(self.segment_label)
+        segment_box.setLayout(segment_layout)
+        left_layout.addWidget(segment_box)
+        self.segments = load_segments()
+        self.refresh_segment_combo()
+        
         # 3. Settings
         settings_box = QGroupBox("Sending Settings")
         settings_layout = QFormLayout()
         
-        self.delay_spin = QSpinBox()
-        self.delay_spin.setRange(1, 60)
-        self.delay_spin.setValue(5)
-        self.delay_spin.setSuffix(" sec")
+        self.rate_spin = QSpinBox()
+        self.rate_spin.setRange(1, 60)
+        self.rate_spin.setValue(12)
+        self.rate_spin.setSuffix(" msg/min")
+        
+        self.hour_cap_spin = QSpinBox()
+        self.hour_cap_spin.setRange(1, 10000)
+        self.hour_cap_spin.setValue(200)
+        
+        self.day_cap_spin = QSpinBox()
+        self.day_cap_spin.setRange(1, 100000)
+        self.day_cap_spin.setValue(1000)
         
         self.max_msg_spin = QSpinBox()
         self.max_msg_spin.setRange(1, 10000)
         self.max_msg_spin.setValue(100)
         
-        settings_layout.addRow("Delay per msg:", self.delay_spin)
+        settings_layout.addRow("Send rate:", self.rate_spin)
+        settings_layout.addRow("Hourly cap:", self.hour_cap_spin)
+        settings_layout.addRow("Daily cap:", self.day_cap_spin)
         settings_layout.addRow("Max Messages:", self.max_msg_spin)
+        
+        self.recycle_spin = QSpinBox()
+        self.recycle_spin.setRange(0, 16000)
+        self.recycle_spin.setSingleStep(100)
+        self.recycle_spin.setValue(1500)
+        self.recycle_spin.setSuffix(" MB")
+        self.recycle_spin.setSpecialValueText("Never")
+        self.recycle_spin.setToolTip("Firefox is restarted between rows once it uses more memory than this, "
+                                     "or once sends get 3x slower than right after launch.")
+        settings_layout.addRow("Restart browser at:", self.recycle_spin)
+        
+        results_layout = QHBoxLayout()
+        self.results_input = QLineEdit()
+        self.results_input.setPlaceholderText("Optional .xlsx or .csv")
+        results_btn = QPushButton("...")
+        results_btn.setFixedWidth(30)
+        results_btn.clicked.connect(self.select_results_file)
+        results_layout.addWidget(self.results_input)
+        results_layout.addWidget(results_btn)
+        settings_layout.addRow("Save results:", results_layout)
         settings_box.setLayout(settings_layout)
         left_layout.addWidget(settings_box)
         
@@ -497,6 +776,20 @@ class MainWindow(QMainWindow):
         self.send_btn.clicked.connect(self.start_blast)
         left_layout.addWidget(self.send_btn)
         
+        # 6. Run Controls
+        control_layout = QHBoxLayout()
+        self.pause_btn = QPushButton("Pause")
+        self.pause_btn.clicked.connect(self.pause_blast)
+        self.resume_btn = QPushButton("Resume")
+        self.resume_btn.clicked.connect(self.resume_blast)
+        self.stop_btn = QPushButton("Stop")
+        self.stop_btn.clicked.connect(self.stop_blast)
+        control_layout.addWidget(self.pause_btn)
+        control_layout.addWidget(self.resume_btn)
+        control_layout.addWidget(self.stop_btn)
+        left_layout.addLayout(control_layout)
+        self.set_run_controls(running=False)
+        
         # --- Right Panel (Preview & Logs) ---
         right_panel = QWidget()
         right_layout = QVBoxLayout(right_panel)
@@ -504,7 +797,35 @@ class MainWindow(QMainWindow):
         # Excel Preview
         preview_box = QGroupBox("Data Preview")
         preview_layout = QVBoxLayout()
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("Show:"))
+        self.status_filter_combo = QComboBox()
+        self.status_filter_combo.addItem("All rows", None)
+        for status in PandasModel.STATUSES:
+            self.status_filter_combo.addItem(status.capitalize(), status)
+        self.status_filter_combo.currentIndexChanged.connect(self.apply_status_filter)
+        filter_layout.addWidget(self.status_filter_combo)
+        
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search... e.g. budi or City:bandung")
+        self.search_input.setToolTip("Bare terms search the loaded columns only; Column:term loads that column first.")
+        # Debounce so we filter once the user pauses typing
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(200)
+        self.search_timer.timeout.connect(self.apply_search)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        filter_layout.addWidget(self.search_input)
+        self.row_count_label = QLabel("")
+        filter_layout.addWidget(self.row_count_label)
+        self.all_columns_cb = QCheckBox("All columns")
+        self.all_columns_cb.setToolTip("Load every sheet column. By default only Phone and columns used by the template are loaded.")
+        self.all_columns_cb.toggled.connect(self.toggle_all_columns)
+        filter_layout.addWidget(self.all_columns_cb)
+        preview_layout.addLayout(filter_layout)
+        
         self.table_view = QTableView()
+        self.table_view.setSortingEnabled(True)
         preview_layout.addWidget(self.table_view)
         preview_box.setLayout(preview_layout)
         right_layout.addWidget(preview_box)
@@ -527,31 +848,361 @@ class MainWindow(QMainWindow):
         splitter.setSizes([400, 600])
         main_layout.addWidget(splitter)
         
-        # Init Env
-        self.open_env_dialog()
+        self.settings = load_settings()
+        self.restore_settings()
+        # Finish restoring once the window is on screen; the profile scan and
+        # sheet loading can be slow
+        QTimer.singleShot(0, self.restore_session)
+
+    def restore_settings(self):
+        s = self.settings
+        if "geometry" in s:
+            self.restoreGeometry(QByteArray.fromHex(s["geometry"].encode()))
+        self.rate_spin.setValue(s.get("rate", self.rate_spin.value()))
+        self.hour_cap_spin.setValue(s.get("hourly_cap", self.hour_cap_spin.value()))
+        self.day_cap_spin.setValue(s.get("daily_cap", self.day_cap_spin.value()))
+        self.max_msg_spin.setValue(s.get("max_messages", self.max_msg_spin.value()))
+        self.recycle_spin.setValue(s.get("recycle_rss_mb", self.recycle_spin.value()))
+        self.results_input.setText(s.get("results_path", ""))
+        self.msg_edit.setPlainText(s.get("template", ""))
+        self.segment_input.setText(s.get("segment", ""))
+        self.all_columns_cb.setChecked(s.get("all_columns", False))
+        image_path = s.get("image_path")
+        if image_path and os.path.exists(image_path):
+            self.image_path = image_path
+            self.img_label.setText(os.path.basename(image_path))
+
+    def restore_session(self):
+        # One click from launch to sending: reuse the saved environment and
+        # reopen the last workbook (from the sheet cache when unchanged)
+        s = self.settings
+        profile_path = os.path.join(s.get("user_data_dir", ""), s.get("profile_dir", ""))
+        if "user_data_dir" in s and (not s["user_data_dir"] or os.path.isdir(profile_path)):
+            self.user_data_dir, self.profile_dir = s["user_data_dir"], s["profile_dir"]
+            if self.profile_dir:
+                self.log(f"Using saved environment. Base: {self.user_data_dir} | Profile: {self.profile_dir}")
+            else:
+                self.log("Using a temporary session (QR scan required).")
+            STARTUP.mark("environment restored")
+        else:
+            self.open_env_dialog()
+        workbook_path = s.get("workbook_path")
+        if workbook_path and os.path.exists(workbook_path):
+            self.open_workbook(workbook_path, s.get("sheets"))
+
+    def save_settings(self):
+        self.settings.update({
+            "geometry": bytes(self.saveGeometry().toHex()).decode(),
+            "rate": self.rate_spin.value(),
+            "hourly_cap": self.hour_cap_spin.value(),
+            "daily_cap": self.day_cap_spin.value(),
+            "max_messages": self.max_msg_spin.value(),
+            "recycle_rss_mb": self.recycle_spin.value(),
+            "results_path": self.results_input.text(),
+            "template": self.msg_edit.toPlainText(),
+            "segment": self.segment_input.text(),
+            "all_columns": self.all_columns_cb.isChecked(),
+            "image_path": self.image_path,
+            "workbook_path": self.workbook_path,
+            "sheets": self.loaded_sheets,
+        })
+        save_settings(self.settings)
+
+    def closeEvent(self, event):
+        self.save_settings()
+        worker = getattr(self, "worker", None)
+        if worker is not None and worker.isRunning():
+            # Let the engine save results and close the browser, but don't
+            # leave it sending after the window is gone
+            worker.stop()
+            # A large results export may still be writing after 10s; it
+            # sends nothing more, so give it time to save
+            if not worker.wait(10000) and not (worker.saving and worker.wait(worker.SAVE_TIMEOUT_MS)):
+                worker.kill()
+                worker.wait()
+        super().closeEvent(event)
 
     def open_env_dialog(self):
-        dlg = EnvDialog(self)
+        dlg = EnvDialog(self, self.settings)
         if dlg.exec():
-            self.user_data_dir, self.profile_dir = dlg.get_data()
-            self.log(f"Environment set. Base: {self.user_data_dir} | Profile: {self.profile_dir}")
+            env = dlg.get_data()
+            self.settings.update(env)
+            self.user_data_dir, self.profile_dir = env["user_data_dir"], env["profile_dir"]
+            self.log(f"Environment set. Base: {self.user_data_dir} | Profile: {self.profile_dir}" + (" (temporary copy)" if env["clone_profile"] else ""))
+        STARTUP.mark("environment selected")
 
     def upload_excel(self):
         fname, _ = QFileDialog.getOpenFileName(self, "Open Excel", "", "Excel Files (*.xlsx *.xls)")
         if fname:
+            self.open_workbook(fname)
+
+    def open_workbook(self, path, sheets=None):
+        # Lists the workbook's sheets and loads `sheets` (the first one by
+        # default) in the background; see sheets_listed
+        self.start_sheet_loader(path, sheets, list_workbook=True)
+
+    def sheets_listed(self, sheets):
+        self.workbook_path = self.sheet_loader.path
+        self.file_label.setText(os.path.basename(self.workbook_path))
+        self.sheet_list.clear()
+        for name, rows in sheets:
+            item = QListWidgetItem(f"{name} ({rows if rows is not None else '?'} rows)")
+            item.setData(Qt.ItemDataRole.UserRole, name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Checked if name in self.sheet_loader.sheets else Qt.CheckState.Unchecked)
+            self.sheet_list.addItem(item)
+        self.sheet_list.setVisible(len(sheets) > 1)
+        self.load_sheets_btn.setVisible(len(sheets) > 1)
+
+    def load_selected_sheets(self):
+        sheets = []
+        for i in range(self.sheet_list.count()):
+            item = self.sheet_list.item(i)
+            if item.checkState() == Qt.CheckState.Checked:
+                sheets.append(item.data(Qt.ItemDataRole.UserRole))
+        if not sheets:
+            QMessageBox.warning(self, "Warning", "Select at least one sheet.")
+            return
+        self.start_sheet_loader(self.workbook_path, sheets)
+
+    def start_sheet_loader(self, path, sheets, list_workbook=False):
+        self.log(f"Loading {', '.join(sheets) if sheets else os.path.basename(path)}...")
+        self.upload_btn.setEnabled(False)
+        self.load_sheets_btn.setEnabled(False)
+        self.send_btn.setEnabled(False)
+        self.sheet_loader = SheetLoadWorker(
+            path,
+            sheets,
+            self.sheet_cache,
+            self.msg_edit.toPlainText(),
+            self.segment_input.text(),
+            self.all_columns_cb.isChecked(),
+            list_workbook
+        )
+        self.sheet_loader.listed.connect(self.sheets_listed)
+        self.sheet_loader.loaded.connect(self.sheets_loaded)
+        self.sheet_loader.failed.connect(self.sheets_failed)
+        self.sheet_loader.start()
+
+    def sheets_loaded(self, source, seconds):
+        STARTUP.mark("sheet loaded")
+        self.sheet_cache = self.sheet_loader.cache
+        self.loaded_sheets = self.sheet_loader.sheets
+        self.source = source
+        self.pending_columns = set()
+        self.pending_blast = None # Asked for on the previous workbook
+        self.df = self.source.df
+        self.model = PandasModel(self.df)
+        self.table_view.setModel(self.model)
+        # Open the sheet in file order rather than the last sort column
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.model.set_search(self.search_input.text())
+        self.apply_segment()
+        self.apply_status_filter()
+        origin = " from cache" if self.source.from_cache else ""
+        self.log(f"Loaded {len(self.df)} rows, {len(self.df.columns)} of {len(self.source.columns)} columns{origin} in {seconds:.2f}s.")
+        self.log_memory()
+        self.sheet_loading_done()
+        self.toggle_watch(self.watch_cb.isChecked())
+
+    def sheets_failed(self, err_msg):
+        self.sheet_loading_done()
+        QMessageBox.critical(self, "Error", err_msg)
+
+    def sheet_loading_done(self):
+        self.upload_btn.setEnabled(True)
+        self.load_sheets_btn.setEnabled(True)
+        self.send_btn.setEnabled(True)
+
+    def toggle_watch(self, checked):
+        if self.file_watcher.files():
+            self.file_watcher.removePaths(self.file_watcher.files())
+        if not checked or self.source is None:
+            return
+        # Appended rows carry every column, so make the loaded frame complete
+        # now instead of lazily loading columns for a changed file later
+        self.all_columns_cb.setChecked(True)
+        self.file_watcher.addPath(self.workbook_path)
+        self.log(f"Watching {os.path.basename(self.workbook_path)} for new rows.")
+
+    def watched_file_changed(self, path):
+        # Editors often save by replacing the file, which drops the watch
+        if os.path.exists(path) and path not in self.file_watcher.files():
+            self.file_watcher.addPath(path)
+        self.watch_timer.start()
+
+    def check_for_new_rows(self):
+        if self.sheet_watcher is not None and self.sheet_watcher.isRunning():
+            self.watch_timer.start() # Check again once the current diff is done
+            return
+        self.sheet_watcher = SheetWatchWorker(self.workbook_path, self.loaded_sheets, self.sheet_cache, self.df)
+        self.sheet_watcher.diffed.connect(self.append_new_rows)
+        self.sheet_watcher.failed.connect(lambda err: self.log(f"Could not re-read workbook: {err}"))
+        self.sheet_watcher.start()
+
+    def append_new_rows(self, new, seconds):
+        if new.empty or not self.watch_cb.isChecked():
+            return
+        from sheets import append_rows
+        start = len(self.df)
+        self.df = append_rows(self.df, new)
+        self.source.df = self.df
+        self.model.extend_frame(self.df)
+        self.apply_segment()
+        positions = np.arange(start, len(self.df))
+        queued = positions[self.model.is_visible(positions)]
+        worker = getattr(self, "worker", None)
+        if worker is not None and worker.isRunning():
+            worker.extend(self.df, queued)
+            self.log(f"Appended {len(new)} new rows ({len(queued)} queued) in {seconds:.2f}s.")
+        else:
+            self.log(f"Appended {len(new)} new rows in {seconds:.2f}s.")
+
+    def required_columns(self):
+        from sheets import campaign_columns
+        return campaign_columns(self.source.columns, self.msg_edit.toPlainText(), self.segment_input.text())
+
+    def show_frame(self, df):
+        # Shows the source's frame after more columns loaded. If the workbook
+        # was saved since it was opened, the source re-read all of it (see
+        # SheetSource.ensure_columns) and the row count may differ.
+        if len(df) == len(self.df):
+            self.model.set_frame(df)
+        else:
+            self.log(f"{os.path.basename(self.workbook_path)} changed on disk; reloaded {len(df)} rows.")
+            if len(df) > len(self.df):
+                self.model.extend_frame(df) # Rows saved since then start as pending
+            else:
+                self.model = PandasModel(df)
+                self.table_view.setModel(self.model)
+                self.model.set_search(self.search_input.text())
+                self.apply_status_filter()
+        self.df = df
+
+    def log_memory(self):
+        mb = 1024 * 1024
+        self.log(f"Memory: {self.source.memory_before / mb:.1f} MB before compaction, {self.source.memory_after / mb:.1f} MB after.")
+
+    def toggle_all_columns(self, checked):
+        if checked and self.source is not None:
+            self.load_columns(self.source.columns)
+
+    def load_columns(self, wanted):
+        # Loads sheet columns a search or segment needs on a SheetLoadWorker,
+        # so typing never parses the workbook on the GUI thread. Returns True
+        # if some of `wanted` isn't loaded yet; columns_loaded then refreshes
+        # the preview and re-applies the search and segment.
+        missing = set(wanted) - set(self.df.columns)
+        if not missing:
+            return False
+        self.pending_columns |= missing
+        if self.column_loader is None: # Else columns_loaded starts the next load
+            self.column_loader = SheetLoadWorker(
+                self.workbook_path, self.loaded_sheets, self.sheet_cache, "", "", False,
+                source=self.source, columns=set(self.df.columns) | self.pending_columns,
+            )
+            self.column_loader.loaded.connect(self.columns_loaded)
+            self.column_loader.failed.connect(self.columns_failed)
+            self.column_loader.start()
+        return True
+
+    def columns_loaded(self, source, seconds):
+        self.column_loader = None
+        if source is not self.source:
+            # Another workbook was opened meanwhile; load what it asked for
+            if self.source is not None and self.pending_columns:
+                self.load_columns(set(self.pending_columns))
+            return
+        self.pending_columns -= set(source.df.columns)
+        self.show_frame(source.df)
+        self.log(f"Loaded columns: {len(self.df.columns)} of {len(self.source.columns)} in {seconds:.2f}s.")
+        self.log_memory()
+        if self.pending_columns:
+            self.load_columns(set(self.pending_columns)) # Asked for during this load
+        self.apply_search()
+        self.apply_segment()
+        if self.pending_blast is not None and self.column_loader is None:
+            self.launch_blast()
+
+    def columns_failed(self, err_msg):
+        self.column_loader = None
+        self.pending_columns = set()
+        self.log(f"Could not load columns: {err_msg}")
+        if self.pending_blast is not None:
+            # e.g. the workbook was moved or deleted after it was opened
+            self.pending_blast = None
+            self.send_btn.setEnabled(True)
+            QMessageBox.critical(self, "Error", f"Could not load the sheet's columns, so nothing was sent:\n{err_msg}")
+
+    def apply_status_filter(self, *_):
+        if self.model is not None:
+            self.model.set_status_filter(self.status_filter_combo.currentData())
+            self.update_row_count()
+
+    def apply_search(self):
+        if self.model is not None:
+            from sheets import search_columns
+            query = self.search_input.text()
+            if self.load_columns(search_columns(query, self.source.columns)):
+                return # Searched once the named columns are in (columns_loaded)
+            self.model.set_search(query)
+            self.update_row_count()
+
+    def apply_segment(self):
+        if self.model is None:
+            return
+        expression = self.segment_input.text().strip()
+        if expression:
+            from sheets import expression_columns
+            if self.load_columns(expression_columns(expression, self.source.columns)):
+                self.segment_label.setText("Loading columns...")
+                return # Re-applied from columns_loaded
+        if not expression:
+            self.model.set_segment_mask(None)
+            self.segment_label.setText("All rows")
+        else:
+            from sheets import evaluate_segment
             try:
-                self.df = pd.read_excel(fname)
-                # Ensure Phone column is string
-                if 'Phone' in self.df.columns:
-                    self.df['Phone'] = self.df['Phone'].astype(str)
-                
-                self.file_label.setText(os.path.basename(fname))
-                
-                model = PandasModel(self.df)
-                self.table_view.setModel(model)
-                self.log(f"Loaded {len(self.df)} rows.")
+                mask = evaluate_segment(self.df, expression)
             except Exception as e:
-                QMessageBox.critical(self, "Error", str(e))
+                # Keep the last valid segment applied while the user is typing
+                self.segment_label.setText(f"Invalid expression: {e}")
+                return
+            self.model.set_segment_mask(mask)
+            self.segment_label.setText(f"{int(mask.sum())} of {len(self.df)} rows match")
+        self.update_row_count()
+
+    def refresh_segment_combo(self):
+        self.segment_combo.clear()
+        self.segment_combo.addItem("(no saved segment)", "")
+        for name, expression in sorted(self.segments.items()):
+            self.segment_combo.addItem(name, expression)
+
+    def select_segment(self, *_):
+        self.segment_input.setText(self.segment_combo.currentData())
+
+    def save_segment(self):
+        expression = self.segment_input.text().strip()
+        if not expression:
+            return
+        current = self.segment_combo.currentIndex()
+        default_name = self.segment_combo.currentText() if current > 0 else ""
+        name, ok = QInputDialog.getText(self, "Save Segment", "Segment name:", text=default_name)
+        if ok and name:
+            self.segments[name] = expression
+            save_segments(self.segments)
+            self.refresh_segment_combo()
+            self.segment_combo.setCurrentText(name)
+
+    def delete_segment(self):
+        name = self.segment_combo.currentText()
+        if self.segment_combo.currentIndex() > 0 and name in self.segments:
+            del self.segments[name]
+            save_segments(self.segments)
+            self.refresh_segment_combo()
+
+    def update_row_count(self):
+        self.row_count_label.setText(f"{self.model.rowCount()} of {len(self.df)} rows")
 
     def select_image(self):
         fname, _ = QFileDialog.getOpenFileName(self, "Select Image", "", "Images (*.png *.jpg *.jpeg *.gif)")
@@ -559,6 +1210,13 @@ class MainWindow(QMainWindow):
             self.image_path = fname
             self.img_label.setText(os.path.basename(fname))
 
+    def select_results_file(self):
+        fname, _ = QFileDialog.getSaveFileName(self, "Save Results", "", "Excel Files (*.xlsx);;CSV Files (*.csv)")
+        if fname:
+            if not fname.lower().endswith((".xlsx", ".csv")):
+                fname += ".xlsx"
+            self.results_input.setText(fname)
+
     def insert_formatting(self, symbol):
         cursor = self.msg_edit.textCursor()
         if cursor.hasSelection():
@@ -586,17 +1244,60 @@ class MainWindow(QMainWindow):
             if QMessageBox.question(self, "Confirm", "Message is empty. Continue?") != QMessageBox.StandardButton.Yes:
                 return
 
+        clone_profile = self.settings.get("clone_profile", False)
+        if self.user_data_dir and self.profile_dir and not clone_profile:
+            pid = profile_lock_pid(os.path.join(self.user_data_dir, self.profile_dir))
+            if pid and QMessageBox.question(self, "Profile In Use",
+                    f"Firefox (pid {pid}) is using the profile {self.profile_dir}, so Selenium cannot open it. Close Firefox first.\n\nStart anyway?") != QMessageBox.StandardButton.Yes:
+                return
+
+        # The campaign's columns (all of them for a results export, which
+        # carries the original rows) load on a SheetLoadWorker first;
+        # columns_loaded then calls launch_blast
+        wanted = set(self.required_columns())
+        if self.results_input.text().strip():
+            wanted |= set(self.source.columns)
+        self.pending_blast = (msg, clone_profile)
         self.send_btn.setEnabled(False)
+        if self.load_columns(wanted):
+            self.log("Loading the campaign's columns before sending...")
+            return
+        self.launch_blast()
+
+    def launch_blast(self):
+        msg, clone_profile = self.pending_blast
+        self.pending_blast = None
+        positions = self.model.visible_positions()
+        if len(positions) == 0:
+            self.send_btn.setEnabled(True)
+            QMessageBox.warning(self, "Warning", "No rows match the current filter.")
+            return
+
+        self.save_settings() # Keep this campaign's inputs even if the app crashes
+        results_path = self.results_input.text().strip()
+
+        self.set_run_controls(running=True)
+        rate = (
+            self.rate_spin.value(),
+            self.hour_cap_spin.value(),
+            self.day_cap_spin.value()
+        )
         self.worker = SenderWorker(
             self.df, 
+            positions,
             msg, 
             self.image_path, 
-            self.delay_spin.value(), 
+            rate, 
             self.max_msg_spin.value(),
             self.user_data_dir,
-            self.profile_dir
+            self.profile_dir,
+            results_path,
+            clone_profile,
+            self.settings.get("lean_browser", False),
+            self.recycle_spin.value()
         )
         self.worker.progress.connect(self.update_progress)
+        self.worker.row_status.connect(self.model.set_status)
         self.worker.finished.connect(self.task_finished)
         self.worker.error.connect(self.task_error)
         self.worker.start()
@@ -605,21 +1306,52 @@ class MainWindow(QMainWindow):
         self.progress_bar.setValue(val)
         self.log(msg)
 
+    def set_run_controls(self, running, paused=False):
+        self.pause_btn.setEnabled(running and not paused)
+        self.resume_btn.setEnabled(running and paused)
+        self.stop_btn.setEnabled(running)
+        self.upload_btn.setEnabled(not running)
+        self.load_sheets_btn.setEnabled(not running)
+
+    def pause_blast(self):
+        self.worker.pause()
+        self.set_run_controls(running=True, paused=True)
+        self.log("Paused. Browser stays open; press Resume to continue.")
+
+    def resume_blast(self):
+        self.worker.resume()
+        self.set_run_controls(running=True)
+        self.log("Resumed.")
+
+    def stop_blast(self):
+        self.worker.stop()
+        self.set_run_controls(running=False)
+        self.log("Stopping...")
+
     def task_finished(self):
         self.send_btn.setEnabled(True)
+        self.set_run_controls(running=False)
+        if self.worker.stopped:
+            self.log("Stopped by user.")
+            return
         QMessageBox.information(self, "Done", "Automation Completed.")
 
     def task_error(self, err_msg):
         self.send_btn.setEnabled(True)
+        self.set_run_controls(running=False)
         self.log(f"CRITICAL ERROR: {err_msg}")
         QMessageBox.critical(self, "Error", err_msg)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Packaged builds start the engine process from this executable
+    STARTUP.mark("modules imported")
     app = QApplication(sys.argv)
     
     # Simple Style
     app.setStyle("Fusion")
     
     window = MainWindow()
+    STARTUP.mark("window built")
     window.show()
+    QTimer.singleShot(0, lambda: STARTUP.mark("window shown"))
     sys.exit(app.exec())
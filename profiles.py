@@ -0,0 +1,272 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import configparser
+import urllib.parse
+
+# Firefox profile discovery for the environment dialog, and disposable
+# profile clones for engine.py.
+# Only the standard library is used so the dialog opens without delay.
+
+# Where Firefox keeps profiles.ini on Linux, in the order we prefer them
+PROFILE_ROOTS = [
+    ("Snap", os.path.join("~", "snap", "firefox", "common", ".mozilla", "firefox")),
+    ("Flatpak", os.path.join("~", ".var", "app", "org.mozilla.firefox", ".mozilla", "firefox")),
+    ("Standard", os.path.join("~", ".mozilla", "firefox")),
+    ("XDG", os.path.join(os.environ.get("XDG_CONFIG_HOME") or os.path.join("~", ".config"), "mozilla", "firefox")),
+]
+
+class FirefoxProfile:
+    # `path` is what the app stores as profile_dir: relative to the root
+    # for IsRelative=1 profiles, absolute otherwise (os.path.join keeps it)
+    def __init__(self, root, name, path, is_default=False):
+        self.root = root
+        self.name = name
+        self.path = path
+        self.is_default = is_default
+
+    @property
+    def full_path(self):
+        return os.path.join(self.root, self.path)
+
+    @property
+    def locked_pid(self):
+        # Checked on every access: Firefox may start or exit at any time
+        return profile_lock_pid(self.full_path)
+
+def find_profile_roots():
+    # [(label, path)] for every known location that has Firefox profiles
+    roots = []
+    for label, path in PROFILE_ROOTS:
+        path = os.path.expanduser(path)
+        if os.path.isfile(os.path.join(path, "profiles.ini")) or os.path.isfile(os.path.join(path, "installs.ini")):
+            roots.append((label, path))
+    return roots
+
+def _read_ini(path):
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    parser.optionxform = str # Keys are case-sensitive (Path, IsRelative, ...)
+    try:
+        parser.read(path, encoding="utf-8")
+    except configparser.Error:
+        pass
+    return parser
+
+def _parse_profiles(root):
+    profiles_ini = _read_ini(os.path.join(root, "profiles.ini"))
+    installs_ini = _read_ini(os.path.join(root, "installs.ini"))
+
+    # Since Firefox 67 each install has its own default profile, listed in
+    # [Install...] sections of both files; the legacy Default=1 flag on a
+    # [Profile...] section is only a fallback
+    install_defaults = set()
+    for parser in (profiles_ini, installs_ini):
+        for section in parser.sections():
+            if section.startswith("Install") or parser is installs_ini:
+                default = parser.get(section, "Default", fallback="")
+                if default:
+                    install_defaults.add(default)
+
+    profiles = []
+    for section in profiles_ini.sections():
+        if not section.startswith("Profile"):
+            continue
+        path = profiles_ini.get(section, "Path", fallback="")
+        if not path:
+            continue
+        if profiles_ini.get(section, "IsRelative", fallback="1") != "1":
+            path = os.path.abspath(path)
+        name = profiles_ini.get(section, "Name", fallback=os.path.basename(path))
+        legacy_default = profiles_ini.get(section, "Default", fallback="0") == "1"
+        profiles.append(FirefoxProfile(root, name, path, path in install_defaults or (legacy_default and not install_defaults)))
+
+    if not profiles_ini.sections():
+        # No profiles.ini (e.g. a copied folder): real profiles have a prefs.js
+        try:
+            for entry in sorted(os.listdir(root)):
+                if os.path.isfile(os.path.join(root, entry, "prefs.js")):
+                    profiles.append(FirefoxProfile(root, entry, entry))
+        except OSError:
+            pass
+
+    profiles.sort(key=lambda p: (not p.is_default, p.name.lower()))
+    return profiles
+
+_scan_cache = {} # root -> (ini modification times, profiles)
+
+def scan_profiles(root):
+    # Profiles under `root`, default first. Parsed once per change of
+    # profiles.ini/installs.ini; lock status is read live from each profile.
+    root = os.path.abspath(os.path.expanduser(root))
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"Not a folder: {root}")
+    stamps = []
+    for name in ("profiles.ini", "installs.ini", ""):
+        try:
+            stamps.append(os.stat(os.path.join(root, name)).st_mtime_ns)
+        except OSError:
+            stamps.append(None)
+    cached = _scan_cache.get(root)
+    if cached and cached[0] == stamps:
+        return cached[1]
+    profiles = _parse_profiles(root)
+    _scan_cache[root] = (stamps, profiles)
+    return profiles
+
+def profile_lock_pid(path):
+    # While a profile is open, Firefox on Linux keeps a `lock` symlink in it
+    # pointing at "<ip>:+<pid>". Returns that pid if the process still runs.
+    try:
+        target = os.readlink(os.path.join(path, "lock"))
+    except OSError:
+        return None
+    pid = target.rpartition("+")[2]
+    if not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return None # Stale lock left by a crashed Firefox
+    except PermissionError:
+        pass # Running as another user
+    return int(pid)
+
+# --- Disposable Profile Clone ---
+
+# Top-level profile files a WhatsApp Web login needs. Everything else
+# (cache2, places.sqlite history, crash reports, ...) is left behind.
+CLONE_FILES = [
+    "prefs.js", "user.js", "times.json", "compatibility.ini", "containers.json",
+    "cookies.sqlite", "permissions.sqlite", "webappsstore.sqlite", "storage.sqlite",
+    "cert9.db", "key4.db", "pkcs11.txt", "serviceworker.txt",
+]
+# Site storage (IndexedDB, localStorage, service worker caches) lives in
+# storage/default/<origin>; only these origins are cloned and synced back
+CLONE_ORIGINS = ["https+++web.whatsapp.com"]
+COOKIE_HOST = "whatsapp.com"
+SQLITE_SIDE_FILES = ("-wal", "-shm", "-journal")
+
+def clone_base_dir(needed_bytes=0):
+    # tmpfs when it has room, so the clone never touches the disk
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        stats = os.statvfs(shm)
+        if stats.f_bavail * stats.f_frsize > 2 * needed_bytes:
+            return shm
+    return tempfile.gettempdir()
+
+def copy_sqlite(src, dst):
+    # The backup API gives a consistent copy even while Firefox has the
+    # database open in WAL mode; fall back to copying the raw files when
+    # Firefox holds an exclusive lock
+    try:
+        source = sqlite3.connect(f"file:{urllib.parse.quote(src)}?mode=ro", uri=True, timeout=1)
+        try:
+            target = sqlite3.connect(dst)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+    except sqlite3.Error:
+        for suffix in ("",) + SQLITE_SIDE_FILES[:1]:
+            if os.path.exists(src + suffix):
+                shutil.copy2(src + suffix, dst + suffix)
+
+def copy_profile_file(src, dst):
+    if src.endswith(".sqlite"):
+        copy_sqlite(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+def copy_profile_tree(src, dst):
+    # copytree that copies SQLite databases safely and skips their side files
+    return shutil.copytree(src, dst, copy_function=copy_profile_file,
+                           ignore=shutil.ignore_patterns(*("*" + suffix for suffix in SQLITE_SIDE_FILES)))
+
+def tree_size(path):
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                pass
+    return total
+
+class ProfileClone:
+    # Disposable copy of a profile with only the files a WhatsApp Web login
+    # needs. Launching from it skips the real profile's cache and history
+    # and never contends for its lock, so Firefox can stay open meanwhile.
+    def __init__(self, source):
+        self.source = source
+        self.path = None
+        self.size = 0
+
+    def _origin_dirs(self, profile):
+        return [os.path.join(profile, "storage", "default", origin) for origin in CLONE_ORIGINS]
+
+    def create(self):
+        files = [name for name in CLONE_FILES if os.path.isfile(os.path.join(self.source, name))]
+        origins = [path for path in self._origin_dirs(self.source) if os.path.isdir(path)]
+        self.size = sum(os.path.getsize(os.path.join(self.source, name)) for name in files)
+        self.size += sum(tree_size(path) for path in origins)
+        self.path = tempfile.mkdtemp(prefix="whatsapp_blast_profile_", dir=clone_base_dir(self.size))
+        try:
+            for name in files:
+                copy_profile_file(os.path.join(self.source, name), os.path.join(self.path, name))
+            for src, dst in zip(origins, self._origin_dirs(self.path)):
+                copy_profile_tree(src, dst)
+        except Exception:
+            self.remove()
+            raise
+        return self.path
+
+    def sync_back(self):
+        # Copies the clone's WhatsApp storage and cookies into the real
+        # profile so a login made in the clone survives. Returns an error
+        # message, or "" when synced. Firefox must be closed on the clone.
+        pid = profile_lock_pid(self.source)
+        if pid:
+            return f"Firefox (pid {pid}) is using {self.source}; login data was not synced back"
+        try:
+            for src, dst in zip(self._origin_dirs(self.path), self._origin_dirs(self.source)):
+                if not os.path.isdir(src):
+                    continue
+                # Swap in a full copy so the real profile never holds half an origin
+                staged, old = dst + ".sync", dst + ".old"
+                shutil.rmtree(staged, ignore_errors=True)
+                copy_profile_tree(src, staged)
+                if os.path.exists(dst):
+                    os.replace(dst, old)
+                os.replace(staged, dst)
+                shutil.rmtree(old, ignore_errors=True)
+            self._sync_cookies()
+        except (OSError, sqlite3.Error) as e:
+            return f"Could not sync login data back to {self.source}: {e}"
+        return ""
+
+    def _sync_cookies(self):
+        src = os.path.join(self.path, "cookies.sqlite")
+        dst = os.path.join(self.source, "cookies.sqlite")
+        if not (os.path.isfile(src) and os.path.isfile(dst)):
+            return
+        db = sqlite3.connect(dst, timeout=5)
+        try:
+            db.execute("ATTACH DATABASE ? AS clone", (src,))
+            # Same Firefox on both sides, so the schemas match; leave out the
+            # id so rows added to the real profile since cloning keep theirs
+            columns = [row[1] for row in db.execute("PRAGMA main.table_info(moz_cookies)") if row[1] != "id"]
+            column_list = ", ".join(columns)
+            with db:
+                db.execute("DELETE FROM main.moz_cookies WHERE host LIKE ?", (f"%{COOKIE_HOST}",))
+                db.execute(f"INSERT INTO main.moz_cookies ({column_list}) SELECT {column_list} FROM clone.moz_cookies WHERE host LIKE ?", (f"%{COOKIE_HOST}",))
+        finally:
+            db.close()
+
+    def remove(self):
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
@@ -0,0 +1,923 @@
+import os
+import sys
+import re
+import csv
+import json
+import time
+import queue
+import zipfile
+import hashlib
+import datetime
+import contextlib
+import tempfile
+import threading
+from xml.etree.ElementTree import iterparse
+import numpy as np
+import pandas as pd
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils.cell import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import from_excel, from_ISO8601, to_excel, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
+from xml.sax.saxutils import escape
+
+from config import CONFIG_DIR
+
+try:
+    import pyarrow # Optional: compact string columns and the Arrow sheet cache
+    import pyarrow.feather
+    import pyarrow.ipc
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+CACHE_DIR = os.path.join(CONFIG_DIR, "cache")
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# --- Data Loading ---
+
+PLACEHOLDER_RE = re.compile(r"\{([^{}]+)\}")
+
+def template_columns(template, columns):
+    # Sheet columns referenced as {Column} placeholders in the template
+    used = set(PLACEHOLDER_RE.findall(template))
+    return [col for col in columns if str(col) in used]
+
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+DOC_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+def string_text(el):
+    # Text of a shared or inline string: the plain <t> or the rich text runs'
+    # <t>, skipping phonetic (<rPh>) runs like openpyxl does
+    text = el.findtext(XLSX_NS + "t")
+    if text is not None:
+        return text
+    return "".join(run.findtext(XLSX_NS + "t") or "" for run in el.iter(XLSX_NS + "r"))
+
+class XlsxReader:
+    # Streaming reader for .xlsx sheets that only converts the cells of the
+    # requested columns. openpyxl (and so pd.read_excel) builds a cell object
+    # for every cell even when `usecols` is given, which dominates load time
+    # on wide CRM exports. Cells are typed the way openpyxl would type them.
+    #
+    # The file is opened per part read rather than held for the session, so
+    # nothing keeps it open (and editors can save it) between loads.
+    def __init__(self, path):
+        self.path = path
+        self._shared_strings = None
+        self._date_styles = None
+        self._read_workbook()
+
+    @contextlib.contextmanager
+    def _part(self, member):
+        # The zip member as a file, or None if the workbook doesn't have it
+        with zipfile.ZipFile(self.path) as workbook:
+            if member not in workbook.NameToInfo:
+                yield None
+                return
+            with workbook.open(member) as f:
+                yield f
+
+    def _read_workbook(self):
+        with self._part("xl/_rels/workbook.xml.rels") as f:
+            targets = {}
+            for _, el in iterparse(f):
+                if el.tag == PKG_REL_NS + "Relationship":
+                    target = el.get("Target")
+                    # Targets are either absolute in the package or relative to xl/
+                    targets[el.get("Id")] = target.lstrip("/") if target.startswith("/") else "xl/" + target
+        self.sheet_paths = {} # sheet name -> zip member, in workbook order
+        self.epoch = CALENDAR_WINDOWS_1900
+        with self._part("xl/workbook.xml") as f:
+            for _, el in iterparse(f):
+                if el.tag == XLSX_NS + "sheet":
+                    self.sheet_paths[el.get("name")] = targets[el.get(DOC_REL_NS + "id")]
+                elif el.tag == XLSX_NS + "workbookPr" and el.get("date1904") in ("1", "true"):
+                    self.epoch = CALENDAR_MAC_1904
+
+    @property
+    def sheet_names(self):
+        return list(self.sheet_paths)
+
+    def sheet_rows(self, sheet):
+        # Data rows (excluding the header) from the sheet's <dimension> tag,
+        # which precedes the cell data, so no cells are parsed. None if the
+        # writer didn't record a dimension.
+        with self._part(self.sheet_paths[sheet]) as f:
+            for _, el in iterparse(f, events=("start",)):
+                if el.tag == XLSX_NS + "dimension":
+                    last_row = el.get("ref", "").split(":")[-1].lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+                    return max(0, int(last_row) - 1) if last_row.isdigit() else None
+                if el.tag == XLSX_NS + "sheetData":
+                    return None
+        return None
+
+    def shared_strings(self):
+        if self._shared_strings is None:
+            self._shared_strings = []
+            with self._part("xl/sharedStrings.xml") as f:
+                for _, el in iterparse(f) if f is not None else ():
+                    if el.tag == XLSX_NS + "si":
+                        self._shared_strings.append(string_text(el))
+                        el.clear()
+        return self._shared_strings
+
+    def date_styles(self):
+        # Indices into cellXfs whose number format displays a date
+        if self._date_styles is None:
+            self._date_styles = set()
+            custom_formats = {}
+            xf_formats = []
+            in_cell_xfs = False
+            with self._part("xl/styles.xml") as f:
+                for event, el in iterparse(f, events=("start", "end")) if f is not None else ():
+                    if el.tag == XLSX_NS + "cellXfs":
+                        in_cell_xfs = event == "start"
+                    elif event == "end" and el.tag == XLSX_NS + "numFmt":
+                        custom_formats[int(el.get("numFmtId"))] = el.get("formatCode")
+                    elif event == "end" and el.tag == XLSX_NS + "xf" and in_cell_xfs:
+                        xf_formats.append(int(el.get("numFmtId", 0)))
+            for index, fmt_id in enumerate(xf_formats):
+                fmt = custom_formats.get(fmt_id, BUILTIN_FORMATS.get(fmt_id))
+                if fmt and is_date_format(fmt):
+                    self._date_styles.add(index)
+        return self._date_styles
+
+    def _cell_value(self, cell):
+        cell_type = cell.get("t", "n")
+        if cell_type == "inlineStr":
+            inline = cell.find(XLSX_NS + "is")
+            return None if inline is None else string_text(inline)
+        value = cell.findtext(XLSX_NS + "v")
+        if value is None:
+            return None
+        if cell_type == "s":
+            return self.shared_strings()[int(value)]
+        if cell_type == "str":
+            return value
+        if cell_type == "d":
+            return from_ISO8601(value) # ISO 8601 date cells, as openpyxl reads them
+        if cell_type == "b":
+            return value == "1"
+        if cell_type == "e":
+            return None # Error values (#N/A etc.) load as missing, like pandas
+        if "." in value or "E" in value or "e" in value:
+            number = float(value)
+        else:
+            number = int(value)
+        if int(cell.get("s", 0)) in self.date_styles():
+            return from_excel(number, self.epoch)
+        return number
+
+    def _rows(self, sheet, wanted=None):
+        # Yields (row number, {column index: cell element}) for each non-blank
+        # row, keeping only `wanted` column indices when given. Blankness is
+        # judged on the whole row so every projection sees the same rows.
+        letters_to_index = {}
+        row_number = 0
+        with self._part(self.sheet_paths[sheet]) as f:
+            for _, el in iterparse(f):
+                if el.tag != XLSX_NS + "row":
+                    continue
+                row_number = int(el.get("r", row_number + 1))
+                cells = {}
+                has_value = False
+                col = 0
+                for cell in el:
+                    ref = cell.get("r")
+                    if ref:
+                        letters = ref.rstrip("0123456789")
+                        col = letters_to_index.get(letters)
+                        if col is None:
+                            col = letters_to_index[letters] = column_index_from_string(letters)
+                    else:
+                        col += 1
+                    if len(cell):
+                        has_value = True
+                        if wanted is None or col in wanted:
+                            cells[col] = cell
+                if has_value:
+                    yield row_number, cells
+                el.clear()
+
+    def header(self, sheet):
+        # Column names from the first non-blank row, named like pandas names them
+        for _, cells in self._rows(sheet):
+            last = max(cells)
+            names = {}
+            seen = {}
+            for col in range(min(cells), last + 1):
+                name = self._cell_value(cells[col]) if col in cells else None
+                name = f"Unnamed: {col - 1}" if name is None else str(name)
+                if name in seen:
+                    seen[name] += 1
+                    name = f"{name}.{seen[name]}"
+                else:
+                    seen[name] = 0
+                names[col] = name
+            return names
+        return {}
+
+    def read(self, sheet, columns=None):
+        # DataFrame of the sheet restricted to `columns` (header names), in
+        # sheet order. Like pd.read_excel, blank rows inside the data are
+        # kept and trailing ones dropped.
+        header = self.header(sheet)
+        wanted = {col: name for col, name in header.items() if columns is None or name in columns}
+        values = {col: [] for col in wanted}
+        rows = self._rows(sheet, set(wanted))
+        last_row, _ = next(rows, (0, None)) # Header row
+        for row_number, cells in rows:
+            for out in values.values():
+                out.extend([None] * (row_number - last_row - 1))
+            last_row = row_number
+            for col, out in values.items():
+                cell = cells.get(col)
+                out.append(None if cell is None else self._cell_value(cell))
+        frame = {}
+        for col, out in values.items():
+            series = pd.Series(out)
+            # Mixed columns keep None for blank cells; pandas reads them as NaN
+            frame[wanted[col]] = series.where(series.notna(), np.nan) if series.dtype == object else series
+        return pd.DataFrame(frame)
+
+PHONE_KEY_RE = r"^[1-9][0-9]{0,17}$" # Fits int64 and has no leading zero to lose
+
+def compact_dtypes(df, category_ratio=0.5):
+    # Shrinks freshly loaded columns in place of generic object/str storage:
+    #   Phone          -> nullable Int64 when every value is a plain number
+    #   low-cardinality text (City, Segment...) -> category
+    #   other text     -> pyarrow-backed strings (when pyarrow is installed)
+    #   integers       -> smallest integer type that fits
+    out = {}
+    for col in df.columns:
+        series = df[col]
+        if col == 'Phone':
+            out[col] = compact_phone(series)
+            continue
+        if pd.api.types.is_integer_dtype(series.dtype) and not isinstance(series.dtype, pd.CategoricalDtype):
+            out[col] = pd.to_numeric(series, downcast="integer")
+            continue
+        is_text = pd.api.types.is_string_dtype(series.dtype) and not isinstance(series.dtype, pd.CategoricalDtype)
+        if series.dtype == object:
+            # Only convert object columns that hold nothing but strings
+            non_null = series.dropna()
+            is_text = non_null.map(type).eq(str).all()
+        if not is_text:
+            out[col] = series
+            continue
+        non_null_count = series.count()
+        if non_null_count and series.nunique() / non_null_count <= category_ratio:
+            out[col] = series.astype("category")
+        elif HAS_PYARROW:
+            out[col] = series.astype(pd.StringDtype(storage="pyarrow", na_value=np.nan))
+        elif series.dtype == object:
+            out[col] = series.astype(str).where(series.notna())
+        else:
+            out[col] = series
+    return pd.DataFrame(out, index=df.index)
+
+def compact_phone(series):
+    # Integer phone keys where possible (8 bytes instead of a Python string),
+    # otherwise a plain string column
+    if pd.api.types.is_float_dtype(series.dtype):
+        non_null = series.dropna()
+        if (non_null == non_null.round()).all() and (non_null.abs() < 2**63).all():
+            series = series.astype("Int64")
+    elif not pd.api.types.is_integer_dtype(series.dtype):
+        text = series.astype(str).str.strip().where(series.notna())
+        if not text.dropna().str.fullmatch(PHONE_KEY_RE).all():
+            return text
+        series = pd.to_numeric(text).astype("Int64")
+    # The nullable mask costs a byte per row, so only keep it when needed
+    return series.astype("Int64" if series.isna().any() else "int64")
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+def cell_text(value):
+    # A cell as text that stays the same whatever dtype the column loads as:
+    # 628123 and "628123" match, as do 5 and 5.0; missing values are ""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, (bool, np.bool_)):
+        return str(bool(value))
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value).strip()
+
+def phone_text(value):
+    # Phone cell (int, float, string or missing) as the digits string we dial
+    return cell_text(value)
+
+def is_xlsx(path):
+    return path.lower().endswith((".xlsx", ".xlsm"))
+
+def list_sheets(path):
+    # [(sheet name, data row count or None)] from workbook metadata only
+    if is_xlsx(path):
+        reader = XlsxReader(path)
+        return [(name, reader.sheet_rows(name)) for name in reader.sheet_names]
+    return [(name, None) for name in pd.ExcelFile(path).sheet_names]
+
+QUOTED_RE = re.compile(r"\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*'")
+BACKTICK_RE = re.compile(r"`([^`]+)`")
+NAME_RE = re.compile(r"[^\W\d]\w*")
+
+def expression_columns(expression, columns):
+    # Columns a segment expression refers to: bare names and `backticked`
+    # ones, ignoring words inside string literals ("Bandung")
+    if not expression:
+        return []
+    unquoted = QUOTED_RE.sub(" ", expression)
+    names = set(BACKTICK_RE.findall(unquoted))
+    names |= set(NAME_RE.findall(BACKTICK_RE.sub(" ", unquoted)))
+    return [col for col in columns if str(col) in names]
+
+def search_columns(query, columns):
+    # Columns named by `Column:term` search terms (case-insensitive)
+    by_name = {str(col).lower(): col for col in columns}
+    named = [term.partition(":")[0].lower() for term in query.split() if ":" in term]
+    return [by_name[name] for name in named if name in by_name]
+
+def campaign_columns(columns, template, expression):
+    # Columns a send needs: Phone, template placeholders and any column
+    # mentioned by the segment expression
+    needed = {'Phone'} | set(template_columns(template, columns))
+    needed |= set(expression_columns(expression, columns))
+    return needed
+
+class SheetCache:
+    # Parsed sheets kept on disk in columnar form so re-opening an unchanged
+    # workbook skips Excel parsing. With pyarrow, entries are uncompressed
+    # Arrow IPC files read through a memory map; without it they are pickles.
+    #
+    # Entries are keyed by the workbook's content hash plus sheet name. The
+    # hash is only recomputed when a file's size or mtime changes, and
+    # entries for content that no path points at any more are dropped.
+    # Callers take the fingerprint once, when they open the file they parse,
+    # and pass it to header/read/write, so data is never stored under the
+    # hash of a newer version of the file.
+    # Least recently used entries are evicted beyond `max_bytes`.
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+        self.index.setdefault("files", {}) # path -> {size, mtime_ns, hash}
+        self.index.setdefault("entries", {}) # "hash:sheet" -> entry info
+
+    def _save_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def fingerprint(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self.lock:
+            known = self.index["files"].get(path)
+            if known and known["size"] == st.st_size and known["mtime_ns"] == st.st_mtime_ns:
+                return known["hash"]
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self.lock:
+            self.index["files"][path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": content_hash}
+            if known and known["hash"] != content_hash:
+                self._drop_unreferenced(known["hash"])
+            self._save_index()
+        return content_hash
+
+    def _drop_unreferenced(self, content_hash):
+        if any(f["hash"] == content_hash for f in self.index["files"].values()):
+            return
+        for key in [k for k in self.index["entries"] if k.startswith(content_hash + ":")]:
+            self._remove_entry(key)
+
+    def _remove_entry(self, key):
+        entry = self.index["entries"].pop(key)
+        try:
+            os.remove(os.path.join(self.cache_dir, entry["file"]))
+        except OSError:
+            pass
+
+    def _entry(self, fingerprint, sheet):
+        key = f"{fingerprint}:{sheet}"
+        entry = self.index["entries"].get(key)
+        if entry and not os.path.exists(os.path.join(self.cache_dir, entry["file"])):
+            with self.lock:
+                self.index["entries"].pop(key, None)
+            return key, None
+        return key, entry
+
+    def header(self, fingerprint, sheet):
+        # Full column list of the sheet, or None if it has never been cached
+        _, entry = self._entry(fingerprint, sheet)
+        return entry["header"] if entry else None
+
+    def read(self, fingerprint, sheet, columns):
+        # Cached DataFrame with just `columns`, or None unless all are cached
+        key, entry = self._entry(fingerprint, sheet)
+        if not entry or not set(columns) <= set(entry["columns"]):
+            return None
+        file_path = os.path.join(self.cache_dir, entry["file"])
+        try:
+            if entry["file"].endswith(".arrow"):
+                df = pyarrow.feather.read_table(file_path, columns=list(columns), memory_map=True).to_pandas()
+            else:
+                df = pd.read_pickle(file_path)[list(columns)]
+        except Exception as e:
+            print(f"Dropping unreadable cache entry {entry['file']}: {e}", file=sys.stderr)
+            with self.lock:
+                self._remove_entry(key)
+                self._save_index()
+            return None
+        with self.lock:
+            entry["used"] = time.time()
+            self._save_index()
+        return df
+
+    def write(self, fingerprint, sheet, header, df):
+        # Stores every loaded column of the sheet, replacing the old entry
+        key, _ = self._entry(fingerprint, sheet)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        suffix = ".arrow" if HAS_PYARROW else ".pkl"
+        file_name = hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + suffix
+        file_path = os.path.join(self.cache_dir, file_name)
+        tmp_path = file_path + ".tmp"
+        try:
+            if HAS_PYARROW:
+                pyarrow.feather.write_feather(df.reset_index(drop=True), tmp_path, compression="uncompressed")
+            else:
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, file_path)
+        except Exception as e:
+            print(f"Could not write sheet cache: {e}", file=sys.stderr)
+            return
+        with self.lock:
+            self.index["entries"][key] = {
+                "file": file_name,
+                "header": [str(col) for col in header],
+                "columns": [str(col) for col in df.columns],
+                "bytes": os.path.getsize(file_path),
+                "used": time.time(),
+            }
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        entries = self.index["entries"]
+        total = sum(entry["bytes"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["used"]):
+            if total <= self.max_bytes:
+                break
+            total -= entries[key]["bytes"]
+            self._remove_entry(key)
+
+class SheetSource:
+    # One Excel sheet loaded column-by-column on demand. Only the columns a
+    # campaign needs (Phone plus template placeholders) are parsed up front;
+    # the rest are read lazily, e.g. when the user browses the full sheet.
+    # Parsed columns go through SheetCache when one is given.
+    #
+    # The file's state is noted when it is opened (see open_workbook); if the
+    # file changes later, the next ensure_columns re-reads the whole sheet
+    # rather than adding columns of the new version to rows of the old one.
+    def __init__(self, path, cache=None, sheet=None, workbook=None):
+        self.path = path
+        self.cache = cache
+        self.sheet = sheet
+        self._open(workbook or open_workbook(path, cache))
+
+    def _open(self, workbook):
+        self.reader, self.file_state, self.fingerprint = workbook
+        if self.reader is not None:
+            self.sheet = self.sheet or self.reader.sheet_names[0]
+        else:
+            self.sheet = self.sheet or "" # Legacy .xls goes through pandas
+        self.columns = self.cache.header(self.fingerprint, self.sheet) if self.cache else None
+        if self.columns is None:
+            if self.reader is not None:
+                self.columns = list(self.reader.header(self.sheet).values())
+            else:
+                self.columns = [str(col) for col in pd.read_excel(self.path, sheet_name=self.sheet or 0, nrows=0).columns]
+        self.df = None
+        self.from_cache = False
+        self.memory_before = 0 # Bytes before/after compact_dtypes, loaded columns only
+        self.memory_after = 0
+
+    def changed(self):
+        # True if the file on disk is no longer the one this source opened
+        return file_state(self.path) != self.file_state
+
+    @property
+    def fully_loaded(self):
+        return self.df is not None and len(self.df.columns) == len(self.columns)
+
+    def ensure_columns(self, wanted):
+        # Loads any of `wanted` not loaded yet. Returns True if df changed.
+        wanted = set(wanted)
+        if self.df is not None and self.changed():
+            # Saved since it was opened: start over from the new version,
+            # with the columns loaded so far plus the wanted ones
+            wanted |= set(self.df.columns)
+            self._open(open_workbook(self.path, self.cache))
+        loaded = set() if self.df is None else set(self.df.columns)
+        missing = [col for col in self.columns if col in wanted and col not in loaded]
+        if self.df is not None and not missing:
+            return False
+        # Always load at least one column so the row count is known
+        missing = missing or self.columns[:1]
+        new = self.cache.read(self.fingerprint, self.sheet, missing) if self.cache else None
+        self.from_cache = new is not None
+        if new is None:
+            if self.reader is not None:
+                new = self.reader.read(self.sheet, missing)
+            else:
+                new = pd.read_excel(self.path, sheet_name=self.sheet or 0, usecols=missing)
+                new.columns = [str(col) for col in new.columns]
+            self.memory_before += int(new.memory_usage(deep=True).sum())
+            new = compact_dtypes(new)
+        else:
+            self.memory_before += int(new.memory_usage(deep=True).sum())
+        self.memory_after += int(new.memory_usage(deep=True).sum())
+        if self.df is not None:
+            new = pd.concat([self.df, new], axis=1)
+        # Keep the sheet's column order regardless of load order
+        self.df = new[[col for col in self.columns if col in new.columns]]
+        # Not cached if the file changed while it was read: the reader may
+        # have seen either version
+        if self.cache and not self.from_cache and not self.changed():
+            self.cache.write(self.fingerprint, self.sheet, self.columns, self.df)
+        return True
+
+    def load_all(self):
+        return self.ensure_columns(self.columns)
+
+class MultiSheetSource:
+    # Several sheets of one workbook combined into a single campaign, with a
+    # column recording which sheet each row came from. Offers the same
+    # interface as SheetSource; each sheet still loads only the columns asked
+    # for, and a column missing from a sheet is blank for its rows.
+    def __init__(self, sources):
+        self.sources = sources
+        self.path = sources[0].path
+        self.columns = []
+        for source in sources:
+            self.columns += [col for col in source.columns if col not in self.columns]
+        self.sheet_column = "Sheet" if "Sheet" not in self.columns else "Source Sheet"
+        self.columns.append(self.sheet_column)
+        self.df = None
+
+    @property
+    def from_cache(self):
+        return all(source.from_cache for source in self.sources)
+
+    @property
+    def memory_before(self):
+        return sum(source.memory_before for source in self.sources)
+
+    @property
+    def memory_after(self):
+        return sum(source.memory_after for source in self.sources)
+
+    @property
+    def fully_loaded(self):
+        return all(source.fully_loaded for source in self.sources)
+
+    def ensure_columns(self, wanted):
+        wanted = set(wanted)
+        changed = False
+        for source in self.sources:
+            changed |= source.ensure_columns(wanted & set(source.columns))
+        if self.df is not None and not changed:
+            return False
+        parts = [source.df.assign(**{self.sheet_column: source.sheet}) for source in self.sources]
+        df = pd.concat(parts, ignore_index=True)
+        for col in df.columns:
+            # Categoricals with different categories per sheet concat to plain
+            # values; re-encode them over the combined categories
+            if col == self.sheet_column or any(isinstance(part[col].dtype, pd.CategoricalDtype) for part in parts if col in part):
+                df[col] = df[col].astype("category")
+        self.df = df[[col for col in self.columns if col in df.columns]]
+        return True
+
+    def load_all(self):
+        return self.ensure_columns(self.columns)
+
+def canonical_text(series):
+    # Column as cell_text strings, so comparisons survive a reload that
+    # changes its dtype (e.g. Phone turning from int64 to text once a
+    # "0812..." row is added). Converted per dtype, not per cell.
+    present = series.notna().to_numpy(dtype=bool)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Each category once, then spread over the rows
+        categories = canonical_text(pd.Series(series.cat.categories)).to_numpy(dtype=object)
+        return pd.Series(categories[series.cat.codes.to_numpy()], index=series.index).where(present, "")
+    if pd.api.types.is_bool_dtype(series.dtype):
+        text = series.astype(str)
+    elif pd.api.types.is_integer_dtype(series.dtype):
+        text = series.astype("Int64").astype(str)
+    elif pd.api.types.is_float_dtype(series.dtype):
+        # Whole numbers without the ".0", so 5.0 matches an int column's 5
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        whole = present & (values == np.round(values))
+        text = series.astype(str).astype(object)
+        text[whole] = [str(int(v)) for v in values[whole]] if not (np.abs(values[whole]) < 2**63).all() \
+            else values[whole].astype(np.int64).astype(str)
+    elif value_kind(series) == "text":
+        text = series.astype(str).str.strip()
+    else:
+        return series.astype(object).map(cell_text) # Mixed or other values, one cell at a time
+    return text.astype(object).where(present, "")
+
+def value_kind(series):
+    # Which dtypes hold comparable values: reloading may pick int16 instead
+    # of int32, or category instead of strings, for the same cells
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return "text" if pd.api.types.is_string_dtype(series.cat.categories.dtype) else str(series.cat.categories.dtype)
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return "int"
+    if pd.api.types.is_float_dtype(series.dtype):
+        return "float"
+    if pd.api.types.is_string_dtype(series.dtype):
+        if series.dtype != object or series.dropna().map(type).eq(str).all():
+            return "text"
+    return str(series.dtype)
+
+def column_hashes(series, kind):
+    # One uint64 per cell, equal for equal values of the same kind
+    if kind == "text" and isinstance(series.dtype, pd.CategoricalDtype):
+        # Each category once; missing cells have code -1 and hash as 0
+        categories = pd.util.hash_array(series.cat.categories.to_numpy(dtype=object), categorize=False)
+        return np.append(categories, np.uint64(0))[series.cat.codes.to_numpy()]
+    if kind == "int":
+        values = series.to_numpy(dtype=np.int64, na_value=np.iinfo(np.int64).min)
+    elif kind == "float":
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    else:
+        values = series.to_numpy(dtype=object)
+    return pd.util.hash_array(values)
+
+def hash_rows(hashes, rows):
+    # Combines per-column hashes into one uint64 per row
+    combined = np.zeros(rows, dtype=np.uint64)
+    for column in hashes:
+        combined = (combined * np.uint64(1000003)) ^ column
+    return combined
+
+def find_new_rows(old_df, new_df):
+    # Positions in new_df of rows that aren't in old_df yet. Rows are compared
+    # by content over the columns both frames share; a row whose Phone is
+    # already in old_df counts as known too, so an edited row is never
+    # queued (and messaged) a second time.
+    #
+    # Columns of the same kind in both frames are hashed as they are; only
+    # one whose dtype changed between loads (e.g. Phone turning from int64
+    # to text once a "0812..." row is added) goes through canonical_text.
+    columns = [col for col in old_df.columns if col in new_df.columns]
+    old_hashes, new_hashes = [], []
+    for col in columns:
+        kind = value_kind(old_df[col])
+        if kind == value_kind(new_df[col]):
+            old_hashes.append(column_hashes(old_df[col], kind))
+            new_hashes.append(column_hashes(new_df[col], kind))
+        else:
+            old_hashes.append(column_hashes(canonical_text(old_df[col]), "text"))
+            new_hashes.append(column_hashes(canonical_text(new_df[col]), "text"))
+    fresh = ~np.isin(hash_rows(new_hashes, len(new_df)), hash_rows(old_hashes, len(old_df)))
+    if 'Phone' in columns:
+        old_phones = canonical_text(old_df['Phone'])
+        known_phone = canonical_text(new_df['Phone']).isin(old_phones[old_phones != ""])
+        fresh &= ~known_phone.to_numpy(dtype=bool)
+    return np.flatnonzero(fresh)
+
+def append_rows(df, new):
+    # df followed by `new`, keeping categorical columns categorical
+    combined = pd.concat([df, new], ignore_index=True)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            combined[col] = combined[col].astype("category")
+    return combined
+
+def file_state(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def open_workbook(path, cache=None):
+    # (XlsxReader or None for .xls, file state, cache fingerprint or None).
+    # The state and fingerprint are taken before the reader opens the file,
+    # so a save in between shows up as a change rather than going unnoticed.
+    state = file_state(path)
+    fingerprint = cache.fingerprint(path) if cache else None
+    reader = XlsxReader(path) if is_xlsx(path) else None
+    return reader, state, fingerprint
+
+def open_sheets(path, sheets, cache=None):
+    # SheetSource for one sheet, MultiSheetSource for several
+    workbook = open_workbook(path, cache)
+    sources = [SheetSource(path, cache, sheet, workbook) for sheet in sheets]
+    return sources[0] if len(sources) == 1 else MultiSheetSource(sources)
+
+# --- Audience Segments ---
+
+def evaluate_segment(df, expression):
+    # Evaluates a pandas query-style expression (e.g.
+    # `City == "Bandung" and LastPurchase > "2026-01-01"`) over the whole
+    # sheet at once and returns a boolean NumPy array, one entry per row.
+    # Column names with spaces need backticks: `Total Spend` > 100.
+    result = df.eval(expression)
+    if not isinstance(result, pd.Series) or len(result) != len(df):
+        raise ValueError("Expression must produce one true/false value per row")
+    if not pd.api.types.is_bool_dtype(result.dtype):
+        raise ValueError("Expression must be a condition, e.g. City == \"Bandung\"")
+    return result.fillna(False).to_numpy(dtype=bool)
+
+# --- Results Export ---
+
+class ResultWriter:
+    # Streams one line per finished row (the sheet's values plus send
+    # results) to .csv or .xlsx from a background thread, so neither the
+    # worker nor the GUI waits on disk I/O.
+    #
+    # Every line also goes straight to a `<name>.partial.csv` journal, which
+    # is deleted once the results file is complete: an .xlsx is only valid
+    # once saved, and a line written with final=False (a sent row whose
+    # delivery status isn't known yet) is held back from the results file
+    # until the next line for the same key replaces it. So after a crash the
+    # journal has every row, and a finished export has one line per row.
+    RESULT_COLUMNS = ["Status", "Reason", "Attempts", "StartedAt", "FinishedAt", "Delivery"]
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.header = [str(col) for col in columns] + self.RESULT_COLUMNS
+        self.is_xlsx = path.lower().endswith(".xlsx")
+        self.journal_path = path + ".partial.csv"
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="ResultWriter", daemon=True)
+        self.thread.start()
+
+    def write(self, values, key=None, final=True):
+        self.queue.put((values, key, final))
+
+    def close(self):
+        # Finishes writing everything queued so far. Returns the error that
+        # stopped the writer, if any.
+        self.queue.put(None)
+        self.thread.join()
+        return self.error
+
+    def _run(self):
+        closed = False # Seen the None from close()
+        try:
+            with contextlib.ExitStack() as files:
+                journal = files.enter_context(open(self.journal_path, "w", newline="", encoding="utf-8-sig"))
+                journal_writer = csv.writer(journal)
+                journal_writer.writerow(self.header)
+                if self.is_xlsx:
+                    workbook = XlsxWriter()
+                    append = workbook.append
+                else:
+                    results = files.enter_context(open(self.path, "w", newline="", encoding="utf-8-sig"))
+                    results_writer = csv.writer(results)
+                    append = lambda values: results_writer.writerow(["" if v is None else v for v in values])
+                append(self.header)
+                held = {} # key -> line kept back from the results file
+                while True:
+                    item = self.queue.get()
+                    if item is None:
+                        closed = True
+                        break
+                    values, key, final = item
+                    values = [None if is_missing(v) else v for v in values]
+                    journal_writer.writerow(["" if v is None else v for v in values])
+                    held.pop(key, None)
+                    if final:
+                        append(values)
+                    else:
+                        held[key] = values
+                    if self.queue.empty():
+                        journal.flush() # Batch flushes while rows are queued up
+                        if not self.is_xlsx:
+                            results.flush()
+                for values in held.values():
+                    append(values)
+                if self.is_xlsx:
+                    workbook.save(self.path, "Results")
+            os.remove(self.journal_path)
+        except Exception as e:
+            self.error = e
+            print(f"Result export failed: {e}", file=sys.stderr)
+            # Keep draining so writers never block on a dead consumer, up to
+            # close()'s None unless that already came (e.g. the save failed)
+            while not closed:
+                closed = self.queue.get() is None
+
+class XlsxWriter:
+    # Streaming writer for a one-sheet .xlsx, the counterpart of XlsxReader.
+    # openpyxl's write-only mode still builds a cell object per value, which
+    # made saving a 100k-row campaign take the better part of a minute; here
+    # each row goes straight to sheet XML in a temporary file, and save()
+    # zips it up with the few package parts Excel needs. Values are typed
+    # like openpyxl writes them: numbers, booleans, dates with a date style,
+    # and everything else as inline text.
+    def __init__(self):
+        self.sheet_data = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self.rows = 0
+        self.letters = []
+
+    def append(self, values):
+        self.rows += 1
+        row = self.rows
+        while len(self.letters) < len(values):
+            self.letters.append(get_column_letter(len(self.letters) + 1))
+        cells = [f'<row r="{row}">']
+        for letter, value in zip(self.letters, values):
+            kind = type(value)
+            # Plain text and numbers first: they are nearly every cell
+            if kind is str:
+                if not value.isprintable() or "&" in value or "<" in value or ">" in value:
+                    value = escape(ILLEGAL_CHARACTERS_RE.sub("", value))
+                cells.append(f'<c r="{letter}{row}" t="inlineStr"><is><t xml:space="preserve">{value}</t></is></c>')
+            elif kind is int:
+                cells.append(f'<c r="{letter}{row}"><v>{value}</v></c>')
+            elif kind is float:
+                if value - value == 0: # Finite
+                    cells.append(f'<c r="{letter}{row}"><v>{value!r}</v></c>')
+            elif value is not None:
+                cell = self._cell(value)
+                if cell:
+                    cells.append(f'<c r="{letter}{row}"{cell}</c>')
+        cells.append("</row>")
+        self.sheet_data.write("".join(cells))
+
+    def _cell(self, value):
+        # Attributes and content of a <c> after its reference, "" for blanks
+        if isinstance(value, (bool, np.bool_)):
+            return f' t="b"><v>{int(value)}</v>'
+        if isinstance(value, (int, np.integer)):
+            return f"><v>{int(value)}</v>"
+        if isinstance(value, (float, np.floating)):
+            return f"><v>{float(value)!r}</v>" if np.isfinite(value) else ""
+        if isinstance(value, datetime.datetime):
+            return f' s="1"><v>{to_excel(value.replace(tzinfo=None))!r}</v>'
+        if isinstance(value, datetime.date):
+            return f' s="2"><v>{to_excel(value)!r}</v>'
+        text = escape(ILLEGAL_CHARACTERS_RE.sub("", str(value)))
+        return f' t="inlineStr"><is><t xml:space="preserve">{text}</t></is>'
+
+    def save(self, path, sheet_name="Sheet1"):
+        self.sheet_data.seek(0)
+        last_cell = f"{self.letters[-1] if self.letters else 'A'}{max(self.rows, 1)}"
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf: # Fast; sheet XML is repetitive
+            for name, data in XLSX_PARTS.items():
+                zf.writestr(name, data.format(sheet_name=escape(sheet_name, {'"': "&quot;"})))
+            with zf.open("xl/worksheets/sheet1.xml", "w") as f:
+                f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<worksheet xmlns="{XLSX_NS[1:-1]}">'
+                        f'<dimension ref="A1:{last_cell}"/><sheetData>'.encode())
+                for chunk in iter(lambda: self.sheet_data.read(1024 * 1024), ""):
+                    f.write(chunk.encode())
+                f.write(b"</sheetData></worksheet>")
+        self.sheet_data.close()
+
+XLSX_PARTS = {
+    "[Content_Types].xml": """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/><Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/><Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/><Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/></Types>""",
+    "_rels/.rels": """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>""",
+    "xl/workbook.xml": """<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets></workbook>""",
+    "xl/_rels/workbook.xml.rels": """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/><Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/></Relationships>""",
+    # Style 1 is openpyxl's datetime format, style 2 a plain date
+    "xl/styles.xml": """<?xml version="1.0" encoding="UTF-8"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd h:mm:ss"/></numFmts><fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts><fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills><borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders><cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs><cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/><xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs><cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles></styleSheet>""",
+}
+
+def is_missing(value):
+    # Fast paths for the usual cell types, then pandas for NA, NaT, numpy...
+    kind = type(value)
+    if kind is str or kind is int:
+        return False
+    if kind is float:
+        return value != value
+    try:
+        return bool(pd.isna(value))
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,131 @@
+import json
+import time
+
+import pandas as pd
+import pytest
+
+from engine import BlastEngine, RateLimiter, main
+
+
+def make_engine(df, template=""):
+    engine = BlastEngine(df, range(len(df)), template, "", None, len(df))
+    engine.template_fields = [col for col in df.columns if f"{{{col}}}" in template]
+    return engine
+
+
+def test_prepare_row_keeps_int_phone_next_to_float_columns():
+    # A row Series would upcast the int64 phone to float ("...0123.0")
+    df = pd.DataFrame({"Phone": pd.Series([6281234567890123], dtype="int64"), "Score": [1.5]})
+    phone, msg, link, error = make_engine(df, "Score {Score}").prepare_row(0)
+    assert phone == "6281234567890123"
+    assert link.endswith("send?phone=6281234567890123")
+    assert msg == "Score 1.5"
+    assert error == ""
+
+
+def test_write_result_keeps_cell_types():
+    rows = []
+    class Writer:
+        def write(self, values, key=None, final=True):
+            rows.append(values)
+    df = pd.DataFrame({"Phone": pd.Series([6281234567890123], dtype="int64"), "Score": [1.5]})
+    engine = make_engine(df)
+    engine.result_writer = Writer()
+    engine.write_result(0, "sent", "")
+    assert rows[0][:3] == [6281234567890123, 1.5, "sent"]
+    assert str(rows[0][0]) == "6281234567890123"
+
+
+def test_sent_row_is_journaled_before_its_delivery_is_read():
+    rows = []
+    class Writer:
+        def write(self, values, key=None, final=True):
+            rows.append((values, key, final))
+    class Driver:
+        def execute_script(self, script):
+            return {"state": "delivered", "seen": {"pending": 0.1, "sent": 0.8, "delivered": 1.2}}
+    df = pd.DataFrame({"Phone": [628111]})
+    engine = make_engine(df)
+    engine.on_status = lambda pos, status, reason: None
+    engine.result_writer = Writer()
+    engine.tracked_pos = 0
+    engine.set_row_status(0, "sent")
+    assert [(row[1], row[-1], key, final) for row, key, final in rows] == [("sent", "checking", 0, False)]
+    engine.harvest_delivery(Driver())
+    assert [(row[1], row[-1], key, final) for row, key, final in rows] == [("sent", "checking", 0, False), ("sent", "delivered", 0, True)]
+
+
+def test_close_results_lists_unreached_rows_as_pending():
+    rows = []
+    class Writer:
+        path = "results.csv"
+        def write(self, values, key=None, final=True):
+            rows.append(values)
+        def close(self):
+            return None
+    df = pd.DataFrame({"Phone": pd.Series([6281234567890123, 628111, 628222], dtype="int64"), "Score": [1.5, 2.5, None]})
+    engine = make_engine(df)
+    engine.result_writer = Writer()
+    engine.finished_rows.add(1)
+    engine.positions.append(0) # Re-queued after a hang
+    engine.close_results()
+    # Each unreached row once, int64 phones still ints
+    assert [(row[0], row[2]) for row in rows] == [(6281234567890123, "pending"), (628222, "pending")]
+    assert type(rows[0][0]) is int
+
+
+@pytest.mark.parametrize("extra, message", [
+    (["--rate", "0"], "--rate: must be at least 1"),
+    (["--daily-cap", "-5"], "--daily-cap: must be at least 1"),
+    (["--sheet-name", "Leads"], "no sheet named 'Leads'"),
+])
+def test_cli_rejects_bad_arguments_with_usage_status(tmp_path, capsys, extra, message):
+    sheet = tmp_path / "contacts.xlsx"
+    pd.DataFrame({"Phone": [628111]}).to_excel(sheet, index=False, sheet_name="Contacts")
+    template = tmp_path / "message.txt"
+    template.write_text("Hi", encoding="utf-8")
+    with pytest.raises(SystemExit) as exit_info:
+        main(["--sheet", str(sheet), "--template", str(template), *extra])
+    assert exit_info.value.code == 2 # Not 1, which means stopped
+    assert message in capsys.readouterr().err
+
+
+def save_sent(path, ages):
+    # Rate limit state with sends `ages` seconds ago
+    now = time.time()
+    path.write_text(json.dumps({"sent": [now - age for age in ages]}))
+
+
+def test_rate_limiter_hourly_cap_counts_only_the_last_hour(tmp_path):
+    state = tmp_path / "rate.json"
+    save_sent(state, [7200, 3000, 1200, 600])
+    limiter = RateLimiter(60, 3, 100, state_path=str(state))
+    delay, reason = limiter.wait_time()
+    assert reason == "hourly"
+    assert 590 < delay <= 600 # Until the send 3000s ago leaves the window
+    # The send two hours ago still counts towards the day
+    assert RateLimiter(60, 4, 4, state_path=str(state)).wait_time()[1] == "daily"
+
+
+def test_rate_limiter_daily_cap_stops_instead_of_waiting(tmp_path):
+    state = tmp_path / "rate.json"
+    save_sent(state, [90000, 80000, 40000])
+    limiter = RateLimiter(60, 100, 2, state_path=str(state))
+    assert len(limiter.history) == 2 # Older than a day: dropped on load
+    delay, reason = limiter.wait_time()
+    assert reason == "daily"
+    assert 6390 < delay <= 6400
+    sleeps = []
+    assert limiter.acquire(sleep=sleeps.append) is False
+    assert sleeps == []
+
+
+def test_rate_limiter_history_survives_a_restart(tmp_path):
+    state = str(tmp_path / "state" / "rate.json")
+    limiter = RateLimiter(6000, 2, 100, state_path=state) # Token wait of 10 ms
+    for _ in range(2):
+        assert limiter.acquire(sleep=lambda seconds: None)
+        limiter.record_sent()
+    restarted = RateLimiter(60, 2, 100, state_path=state)
+    assert list(restarted.history) == list(limiter.history)
+    assert restarted.wait_time()[1] == "hourly"
@@ -0,0 +1,29 @@
+import sys
+import types
+import multiprocessing
+
+import engine_process
+
+
+def report_modules(conn, options):
+    conn.send([name for name in options["watch"] if name in sys.modules])
+    conn.close()
+
+
+def test_spawn_does_not_rerun_the_gui_script(tmp_path, monkeypatch):
+    # Stands in for main.py: running it in the child would leave a marker
+    marker = tmp_path / "ran"
+    script = tmp_path / "gui.py"
+    script.write_text(f"open({str(marker)!r}, 'w').close()\n")
+    gui = types.ModuleType("__main__")
+    gui.__file__ = str(script)
+    monkeypatch.setitem(sys.modules, "__main__", gui)
+    monkeypatch.setattr(engine_process, "serve", report_modules)
+    conn, child_conn = multiprocessing.Pipe()
+    process = engine_process.spawn(child_conn, {"watch": ["PyQt6", "engine"]})
+    child_conn.close()
+    assert sys.modules["__main__"] is gui
+    assert conn.poll(30)
+    assert conn.recv() == []
+    process.join(10)
+    assert not marker.exists()
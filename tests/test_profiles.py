@@ -0,0 +1,78 @@
+import os
+
+from profiles import _parse_profiles, scan_profiles
+
+
+def write_ini(path, text, mtime_ns=None):
+    path.write_text(text, encoding="utf-8")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_install_default_wins_over_legacy_default_flag(tmp_path):
+    write_ini(tmp_path / "profiles.ini", """
+[Profile0]
+Name=default
+IsRelative=1
+Path=abcd.default
+Default=1
+
+[Profile1]
+Name=WhatsApp
+IsRelative=1
+Path=efgh.default-release
+""")
+    write_ini(tmp_path / "installs.ini", """
+[4F96D1932A9F858E]
+Default=efgh.default-release
+Locked=1
+""")
+    profiles = _parse_profiles(str(tmp_path))
+    assert [(p.name, p.is_default) for p in profiles] == [("WhatsApp", True), ("default", False)]
+    assert profiles[0].full_path == os.path.join(str(tmp_path), "efgh.default-release")
+
+
+def test_legacy_default_and_absolute_paths(tmp_path):
+    elsewhere = tmp_path / "elsewhere" / "work"
+    write_ini(tmp_path / "profiles.ini", f"""
+[General]
+StartWithLastProfile=1
+
+[Profile0]
+Name=Work
+IsRelative=0
+Path={elsewhere}
+
+[Profile1]
+Name=Personal
+IsRelative=1
+Path=ijkl.personal
+Default=1
+""")
+    profiles = _parse_profiles(str(tmp_path))
+    assert [(p.name, p.path, p.is_default) for p in profiles] == [
+        ("Personal", "ijkl.personal", True), # No installs.ini, so Default=1 counts
+        ("Work", str(elsewhere), False),
+    ]
+    assert profiles[1].full_path == str(elsewhere) # os.path.join keeps absolute paths
+
+
+def test_folder_without_profiles_ini_lists_dirs_with_prefs_js(tmp_path):
+    for name in ("b.profile", "a.profile", "Crash Reports"):
+        (tmp_path / name).mkdir()
+    for name in ("b.profile", "a.profile"):
+        (tmp_path / name / "prefs.js").write_text("")
+    assert [p.name for p in _parse_profiles(str(tmp_path))] == ["a.profile", "b.profile"]
+
+
+def test_scan_is_cached_until_an_ini_changes(tmp_path):
+    ini = tmp_path / "profiles.ini"
+    write_ini(ini, "[Profile0]\nName=One\nPath=one\n", mtime_ns=1_000_000_000)
+    first = scan_profiles(str(tmp_path))
+    assert [p.name for p in first] == ["One"]
+    assert scan_profiles(str(tmp_path)) is first
+    write_ini(ini, "[Profile0]\nName=One\nPath=one\n\n[Profile1]\nName=Two\nPath=two\n", mtime_ns=2_000_000_000)
+    assert [p.name for p in scan_profiles(str(tmp_path))] == ["One", "Two"]
+    # installs.ini appearing picks a new default
+    write_ini(tmp_path / "installs.ini", "[ABC]\nDefault=two\n")
+    assert [(p.name, p.is_default) for p in scan_profiles(str(tmp_path))] == [("Two", True), ("One", False)]
@@ -0,0 +1,193 @@
+import datetime
+import os
+import time
+import threading
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sheets import ResultWriter, SheetCache, XlsxReader, XlsxWriter, compact_dtypes, find_new_rows, open_sheets
+
+
+def test_find_new_rows_survives_phone_dtype_change():
+    # All-numeric phones load as int64; one "0812..." row turns the
+    # reloaded column into text, which must not make old rows look new
+    old = compact_dtypes(pd.DataFrame({"Phone": [628123456789, 628111], "Name": ["A", "B"]}))
+    new = compact_dtypes(pd.DataFrame({"Phone": ["628123456789", "628111", "0812555"], "Name": ["A", "B", "C"]}))
+    assert old["Phone"].dtype == "int64"
+    assert not pd.api.types.is_integer_dtype(new["Phone"].dtype)
+    assert find_new_rows(old, new).tolist() == [2]
+
+
+def test_find_new_rows_int_and_float_columns_match():
+    old = pd.DataFrame({"Phone": [1, 2], "Score": [5, 6]})
+    new = pd.DataFrame({"Phone": [1, 2, 3], "Score": [5.0, 6.0, np.nan]})
+    assert find_new_rows(old, new).tolist() == [2]
+
+
+def test_find_new_rows_matches_narrower_and_categorical_reloads():
+    # compact_dtypes may pick int16 vs int32, or category vs strings, for
+    # the same cells depending on the other rows
+    old = pd.DataFrame({"Phone": [1, 2], "Score": pd.Series([-1, 5], dtype="int16"), "City": pd.Series(["A", "B"], dtype="category")})
+    new = pd.DataFrame({"Phone": [1, 2, 3], "Score": pd.Series([-1, 5, 70000], dtype="int32"), "City": ["A", "B", "C"]})
+    assert find_new_rows(old, new).tolist() == [2]
+
+
+def test_find_new_rows_skips_edited_row_with_known_phone():
+    old = pd.DataFrame({"Phone": [628111], "Name": ["A"]})
+    new = pd.DataFrame({"Phone": ["628111", "628222"], "Name": ["A (edited)", "B"]})
+    assert find_new_rows(old, new).tolist() == [1]
+
+
+def test_result_writer_close_returns_when_save_fails(tmp_path):
+    # A directory in place of the .xlsx makes workbook.save fail after
+    # close() has already been called
+    path = tmp_path / "results.xlsx"
+    path.mkdir()
+    writer = ResultWriter(str(path), ["Phone"])
+    writer.write([628111, "sent", "", 1, None, None, ""])
+    done = threading.Event()
+    threading.Thread(target=lambda: (writer.close(), done.set()), daemon=True).start()
+    assert done.wait(5), "close() blocked after a failed save"
+    assert isinstance(writer.error, OSError)
+
+
+WORKBOOK_PARTS = {
+    "[Content_Types].xml": """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>""",
+    "_rels/.rels": """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>""",
+    "xl/workbook.xml": """<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Contacts" sheetId="1" r:id="rId1"/></sheets>
+</workbook>""",
+    "xl/_rels/workbook.xml.rels": """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>
+<Relationship Id="rId3" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>""",
+    "xl/styles.xml": """<?xml version="1.0" encoding="UTF-8"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="1"><fill><patternFill patternType="none"/></fill></fills>
+<borders count="1"><border/></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>""",
+    # A plain string, a rich text string, and one with a phonetic run
+    "xl/sharedStrings.xml": """<?xml version="1.0" encoding="UTF-8"?>
+<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="4" uniqueCount="4">
+<si><t>Phone</t></si>
+<si><t>Joined</t></si>
+<si><r><t>Ban</t></r><r><rPr><b/></rPr><t>dung</t></r></si>
+<si><t>Tokyo</t><rPh sb="0" eb="5"><t>TOKYO</t></rPh></si>
+</sst>""",
+    # Column B has no header, row 3 is blank, and the dates come both as
+    # serial numbers with a date style and as ISO 8601 (t="d") cells
+    "xl/worksheets/sheet1.xml": """<?xml version="1.0" encoding="UTF-8"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<dimension ref="A1:D5"/>
+<sheetData>
+<row r="1"><c r="A1" t="s"><v>0</v></c><c r="C1" t="s"><v>1</v></c><c r="D1" t="inlineStr"><is><t>City</t></is></c></row>
+<row r="2"><c r="A2"><v>628111</v></c><c r="B2" t="inlineStr"><is><r><t>x</t></r><r><t>y</t></r></is></c><c r="C2" s="1"><v>46024</v></c><c r="D2" t="s"><v>2</v></c></row>
+<row r="3"></row>
+<row r="4"><c r="A4"><v>628222</v></c><c r="C4" s="1" t="d"><v>2026-02-03T04:05:06</v></c><c r="D4" t="s"><v>3</v></c></row>
+<row r="5"><c r="A5"><v>628333</v></c><c r="B5" t="b"><v>1</v></c><c r="C5" s="1" t="d"><v>2026-03-04T00:00:00</v></c><c r="D5" t="str"><v>Jakarta</v></c></row>
+</sheetData>
+</worksheet>""",
+}
+
+
+def test_xlsx_reader_matches_read_excel(tmp_path):
+    path = tmp_path / "contacts.xlsx"
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in WORKBOOK_PARTS.items():
+            zf.writestr(name, data)
+    expected = pd.read_excel(path, sheet_name="Contacts")
+    reader = XlsxReader(str(path))
+    assert reader.sheet_names == ["Contacts"]
+    pd.testing.assert_frame_equal(reader.read("Contacts"), expected)
+    pd.testing.assert_frame_equal(reader.read("Contacts", ["City", "Joined"]), expected[["Joined", "City"]])
+
+
+def save_contacts(path, rows, replace):
+    frame = pd.DataFrame({"Phone": [628000 + i for i in range(rows)], "Name": [f"N{i}" for i in range(rows)]})
+    if replace:
+        # Editors often write a new file and rename it over the old one
+        tmp = path.with_name("saving.xlsx")
+        frame.to_excel(tmp, index=False)
+        os.replace(tmp, path)
+    else:
+        frame.to_excel(path, index=False)
+
+
+@pytest.mark.parametrize("replace", [False, True])
+def test_lazy_column_load_after_save_rereads_the_sheet(tmp_path, replace):
+    path = tmp_path / "leads.xlsx"
+    save_contacts(path, 3, replace)
+    cache = SheetCache(str(tmp_path / "cache"))
+    source = open_sheets(str(path), ["Sheet1"], cache)
+    source.ensure_columns(["Phone"])
+    old = source.df.copy()
+    save_contacts(path, 4, replace) # A new lead is saved
+    source.ensure_columns(["Name"])
+    assert source.df["Name"].tolist() == ["N0", "N1", "N2", "N3"]
+    assert len(source.df) == 4
+    # Nothing stale was cached under the new file's hash
+    fresh = open_sheets(str(path), ["Sheet1"], SheetCache(str(tmp_path / "cache")))
+    fresh.load_all()
+    assert len(fresh.df) == 4
+    assert find_new_rows(old, fresh.df).tolist() == [3]
+
+
+def test_xlsx_writer_round_trips_through_read_excel(tmp_path):
+    path = tmp_path / "results.xlsx"
+    writer = XlsxWriter()
+    writer.append(["Phone", "Name", "Joined", "Day", "Opted", "Score", "Note"])
+    writer.append([6281234567890123, "A & <B>\x01", datetime.datetime(2026, 1, 2, 3, 4, 5), datetime.date(2026, 2, 3), True, 1.5, None])
+    writer.append([np.int64(628111), " spaced ", pd.Timestamp("2026-03-04 05:06"), None, np.bool_(False), np.float64(2.0), "x"])
+    writer.save(str(path), "Results")
+    expected = pd.DataFrame({
+        "Phone": [6281234567890123, 628111],
+        "Name": ["A & <B>", " spaced "],
+        "Joined": pd.to_datetime(["2026-01-02 03:04:05", "2026-03-04 05:06:00"]),
+        "Day": pd.to_datetime(["2026-02-03", None]),
+        "Opted": [True, False],
+        "Score": [1.5, 2.0],
+        "Note": [np.nan, "x"],
+    })
+    pd.testing.assert_frame_equal(pd.read_excel(path, sheet_name="Results"), expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("name", ["results.csv", "results.xlsx"])
+def test_result_writer_keeps_one_line_per_row_and_journals_both(tmp_path, name):
+    path = tmp_path / name
+    writer = ResultWriter(str(path), ["Phone"])
+    writer.write([628111, "sent", "", 1, None, None, "checking"], key=0, final=False)
+    writer.write([628222, "failed", "No chat", 1, None, None, ""], key=1)
+    writer.write([628111, "sent", "", 1, None, None, "delivered"], key=0)
+    writer.write([628333, "sent", "", 1, None, None, "checking"], key=2, final=False) # Never harvested
+    journal_path = str(path) + ".partial.csv"
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline and not (os.path.exists(journal_path) and len(open(journal_path).readlines()) == 5):
+        time.sleep(0.01) # The writer thread journals and flushes once the queue is empty
+    journal = pd.read_csv(journal_path)
+    assert journal["Delivery"].fillna("").tolist() == ["checking", "", "delivered", "checking"]
+    assert writer.close() is None
+    results = pd.read_csv(path) if name.endswith(".csv") else pd.read_excel(path)
+    assert results["Phone"].tolist() == [628222, 628111, 628333]
+    assert results["Delivery"].fillna("").tolist() == ["", "delivered", "checking"]
+    assert not os.path.exists(str(path) + ".partial.csv")